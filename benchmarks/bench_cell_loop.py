@@ -0,0 +1,93 @@
+"""Benchmark of the per-cell setup of black and reorder-python-imports.
+
+Compares building black.Mode and the reorder-python-imports tables for every code
+cell with building them once per lab file, and times run() on a 500 cell lab file.
+
+usage: python benchmarks/bench_cell_loop.py [--cells CELLS] [--repeat REPEAT]
+"""
+import argparse
+import contextlib
+import io
+import json
+import tempfile
+import timeit
+from pathlib import Path
+
+import black
+
+from jupyter_cleaner.jupyter_cleaner import _get_cell_cache
+from jupyter_cleaner.jupyter_cleaner import _reorder_imports_tables
+from jupyter_cleaner.jupyter_cleaner import run
+
+PYTHON_VERSION = (3, 10)
+
+
+def make_lab_file(cells: int) -> dict:
+    return {
+        "cells": [
+            {
+                "cell_type": "code",
+                "execution_count": i,
+                "metadata": {},
+                "outputs": [],
+                "source": [
+                    "import re\n",
+                    "import datetime\n",
+                    f"value_{i}=datetime.datetime.now()\n",
+                    f"match_{i}=re.match('a', 'a')",
+                ],
+            }
+            for i in range(cells)
+        ],
+        "metadata": {"language_info": {"version": "3.10.10"}},
+        "nbformat": 4,
+        "nbformat_minor": 2,
+    }
+
+
+def per_cell_setup(cells: int) -> None:
+    for _ in range(cells):
+        black.Mode(is_ipynb=True)
+        _reorder_imports_tables.__wrapped__(PYTHON_VERSION)
+
+
+def hoisted_setup(cells: int) -> None:
+    black.Mode(is_ipynb=True)
+    for _ in range(cells):
+        _reorder_imports_tables(PYTHON_VERSION)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--cells", type=int, default=500)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    for name, setup in (("per cell", per_cell_setup), ("hoisted", hoisted_setup)):
+        seconds = min(
+            timeit.repeat(lambda: setup(args.cells), number=1, repeat=args.repeat)
+        )
+        print(
+            f"{name:>10} setup: {seconds * 1000:8.2f} ms "
+            f"({seconds / args.cells * 1e6:.1f} us/cell)"
+        )
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        file = Path(tmp_dir, "benchmark.ipynb")
+        contents = json.dumps(make_lab_file(args.cells))
+
+        def clean() -> None:
+            file.write_text(contents)
+            _get_cell_cache.cache_clear()
+            with contextlib.redirect_stdout(io.StringIO()):
+                run([file], format=True, reorder_imports=True)
+
+        seconds = min(timeit.repeat(clean, number=1, repeat=args.repeat))
+        print(
+            f"{'run()':>10} total: {seconds * 1000:8.2f} ms "
+            f"({seconds / args.cells * 1e6:.1f} us/cell)"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+"""Regression benchmark of removing empty cells from large lab files.
+
+Cleans lab files where half of the cells are empty, checks that exactly the empty
+cells were removed, and fails if the time taken grows faster than linearly with the
+number of cells or is above a limit.
+
+usage: python benchmarks/bench_empty_cells.py [--cells CELLS] [--repeat REPEAT] [--max_seconds MAX_SECONDS]
+"""
+import argparse
+import json
+import sys
+import time
+
+from jupyter_cleaner.jupyter_cleaner import clean_notebook
+from jupyter_cleaner.jupyter_cleaner import Options
+
+OPTIONS = Options(format=False, reorder_imports=False)
+
+
+def make_lab_file(cells: int) -> dict:
+    # pairs of empty cells, so that a cell following a removed cell is also empty
+    return {
+        "cells": [
+            {
+                "cell_type": "code",
+                "execution_count": None,
+                "metadata": {},
+                "outputs": [],
+                "source": [] if i % 4 < 2 else [f"a_{i} = {i}"],
+            }
+            for i in range(cells)
+        ],
+        "metadata": {"language_info": {"version": "3.10.10"}},
+        "nbformat": 4,
+        "nbformat_minor": 2,
+    }
+
+
+def clean(cells: int, repeat: int) -> float:
+    contents = json.dumps(make_lab_file(cells))
+    times = []
+    for _ in range(repeat):
+        # only the cleaning of the cells is timed, not the parsing of the lab file
+        notebook = json.loads(contents)
+        start = time.perf_counter()
+        clean_notebook(notebook, OPTIONS)
+        times.append(time.perf_counter() - start)
+
+    expected = [[f"a_{i} = {i}"] for i in range(cells) if i % 4 >= 2]
+    if [cell["source"] for cell in notebook["cells"]] != expected:
+        sys.exit(f"{cells} cells: empty cells weren't removed correctly")
+    return min(times)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--cells", type=int, default=10_000)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--max_seconds", type=float, default=0.5)
+    args = parser.parse_args()
+
+    seconds = clean(args.cells, args.repeat)
+    double_seconds = clean(2 * args.cells, args.repeat)
+    for cells, seconds_taken in (
+        (args.cells, seconds),
+        (2 * args.cells, double_seconds),
+    ):
+        print(
+            f"{cells:>8} cells: {seconds_taken * 1000:8.2f} ms "
+            f"({seconds_taken / cells * 1e6:.1f} us/cell)"
+        )
+
+    # removing cells from the list being iterated over made this grow quadratically
+    if double_seconds > 3 * seconds:
+        sys.exit("time taken grows faster than linearly with the number of cells")
+    if seconds > args.max_seconds:
+        sys.exit(f"{args.cells} cells took longer than {args.max_seconds} s")
+
+
+if __name__ == "__main__":
+    main()
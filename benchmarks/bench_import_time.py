@@ -0,0 +1,66 @@
+"""Benchmark of the time taken to import jupyter-cleaner.
+
+Runs `python -X importtime` in a fresh interpreter, prints the slowest imports and
+fails if black or reorder-python-imports are imported before a cell is formatted.
+
+usage: python benchmarks/bench_import_time.py [--module MODULE] [--top TOP] [--repeat REPEAT]
+"""
+import argparse
+import subprocess
+import sys
+from typing import Dict
+from typing import List
+from typing import Tuple
+
+LAZY_MODULES = ("black", "reorder_python_imports")
+
+
+def import_times(module: str) -> List[Tuple[str, int, int]]:
+    """Import a module in a fresh interpreter.
+
+    :return List[Tuple[str, int, int]]: imported package, self and cumulative time in microseconds
+    """
+    stderr = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True,
+        check=True,
+        text=True,
+    ).stderr
+    times = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "[us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:") :].split("|")
+        times.append((name.strip(), int(self_us), int(cumulative_us)))
+    return times
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--module", default="jupyter_cleaner.jupyter_cleaner")
+    parser.add_argument("--top", type=int, default=10)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    runs = [import_times(args.module) for _ in range(args.repeat)]
+    totals = [sum(self_us for _, self_us, _ in times) for times in runs]
+    best: Dict[str, int] = {}
+    for times in runs:
+        for name, _, cumulative_us in times:
+            best[name] = min(best.get(name, cumulative_us), cumulative_us)
+
+    print(f"import {args.module}: {min(totals) / 1000:.1f} ms (best of {args.repeat})")
+    for name, cumulative_us in sorted(best.items(), key=lambda item: -item[1])[
+        : args.top
+    ]:
+        print(f"{cumulative_us / 1000:8.1f} ms  {name}")
+
+    eager = sorted(
+        {name for name in best if name.lstrip().split(".")[0] in LAZY_MODULES}
+    )
+    if eager:
+        sys.exit(f"imported before a cell is formatted: {', '.join(eager)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,121 @@
+"""Benchmark of run() on a synthetic corpus, end-to-end and for each feature.
+
+Generates a corpus with benchmarks/corpus.py and times run() with every feature
+enabled, with no features enabled (reading and writing only), and with each feature
+on its own. Features are also timed on the same corpus without outputs, as reading
+and removing outputs is slower or faster depending on their size. Results can be saved as JSON and compared against a previous run to
+catch regressions.
+
+usage: python benchmarks/bench_run.py [--repeat REPEAT] [--features FEATURES [FEATURES ...]]
+       [--output OUTPUT] [--baseline BASELINE] [--max_slowdown MAX_SLOWDOWN] [corpus options]
+"""
+import argparse
+import contextlib
+import io
+import json
+import shutil
+import sys
+import tempfile
+import timeit
+from pathlib import Path
+from typing import Any
+from typing import Dict
+
+from corpus import add_arguments
+from corpus import corpus_options
+from corpus import write_corpus
+
+from jupyter_cleaner.jupyter_cleaner import _get_cell_cache
+from jupyter_cleaner.jupyter_cleaner import run
+
+NO_FEATURES: Dict[str, Any] = {
+    "execution_count": -1,
+    "remove_outputs": False,
+    "format": False,
+    "reorder_imports": False,
+    "remove_empty_cells": False,
+    "clear_cell_metadata": False,
+}
+FEATURES: Dict[str, Dict[str, Any]] = {
+    "all": {},
+    "none": NO_FEATURES,
+    **{
+        feature: {**NO_FEATURES, feature: 0 if feature == "execution_count" else True}
+        for feature in NO_FEATURES
+    },
+}
+
+
+def time_run(corpus: Path, options: Dict[str, Any], repeat: int) -> float:
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        directory = Path(tmp_dir, "corpus")
+
+        def setup() -> None:
+            shutil.rmtree(directory, ignore_errors=True)
+            shutil.copytree(corpus, directory)
+            # formatted cells would otherwise be reused from the previous repeat
+            _get_cell_cache.cache_clear()
+
+        def clean() -> None:
+            with contextlib.redirect_stdout(io.StringIO()):
+                run(sorted(directory.glob("*.ipynb")), **options)
+
+        times = []
+        for _ in range(repeat):
+            setup()
+            times.extend(timeit.repeat(clean, number=1, repeat=1))
+        return min(times)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument(
+        "--features", nargs="+", choices=list(FEATURES), default=list(FEATURES)
+    )
+    parser.add_argument("--output", type=Path, help="write the results as JSON")
+    parser.add_argument("--baseline", type=Path, help="results of a previous run")
+    parser.add_argument("--max_slowdown", type=float, default=1.2)
+    add_arguments(parser)
+    args = parser.parse_args()
+
+    corpora = {"": corpus_options(args)}
+    if args.output_size > 0:
+        corpora[" (no outputs)"] = {**corpus_options(args), "output_size": 0}
+
+    results: Dict[str, float] = {}
+    for suffix, options in corpora.items():
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            corpus = Path(tmp_dir, "corpus")
+            files = write_corpus(corpus, **options)
+            size = sum(file.stat().st_size for file in files)
+            print(f"corpus{suffix}: {len(files)} lab files, {size / 2**20:.1f} MB")
+            for feature in args.features:
+                name = feature + suffix
+                results[name] = time_run(corpus, FEATURES[feature], args.repeat)
+                print(
+                    f"{name:>32}: {results[name] * 1000:9.1f} ms "
+                    f"({results[name] / len(files) * 1000:.2f} ms/lab file)"
+                )
+
+    if args.output is not None:
+        with open(args.output, "w") as f:
+            json.dump({"corpus": corpus_options(args), "results": results}, f, indent=2)
+
+    if args.baseline is not None:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if baseline["corpus"] != corpus_options(args):
+            sys.exit("the baseline was run on a different corpus")
+        slower = [
+            f"{feature}: {seconds / baseline['results'][feature]:.2f}x"
+            for feature, seconds in results.items()
+            if feature in baseline["results"]
+            and seconds > args.max_slowdown * baseline["results"][feature]
+        ]
+        if slower:
+            sys.exit(f"slower than the baseline: {', '.join(slower)}")
+
+
+if __name__ == "__main__":
+    main()
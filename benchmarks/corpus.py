@@ -0,0 +1,177 @@
+"""Generator of synthetic lab files for benchmarks.
+
+Lab files are generated from a seed, so that the same corpus is generated on every
+run. Each code cell is plain Python, import-heavy or a shell command, and has
+outputs with a configurable payload.
+
+usage: python benchmarks/corpus.py DIRECTORY [--notebooks NOTEBOOKS] [--cells CELLS] [--cell_lines CELL_LINES]
+       [--output_size OUTPUT_SIZE] [--import_cells IMPORT_CELLS] [--shell_cells SHELL_CELLS]
+       [--empty_cells EMPTY_CELLS] [--seed SEED]
+"""
+import argparse
+import base64
+import json
+import random
+from pathlib import Path
+from typing import Any
+from typing import Dict
+from typing import List
+
+MODULES = ("os", "re", "sys", "json", "typing", "datetime", "pathlib", "collections")
+
+
+def make_source(rng: random.Random, lines: int, kind: str) -> List[str]:
+    if kind == "shell":
+        source = [f"!pip install package-{rng.randrange(100)}"]
+    elif kind == "import":
+        source = [f"import {module}" for module in rng.sample(MODULES, 4)]
+        source.append("from typing import List, Dict")
+    else:
+        source = []
+    while len(source) < lines:
+        i = len(source)
+        # unformatted code, so that black has work to do
+        source.append(
+            rng.choice(
+                (
+                    f"value_{i}=[x*{i} for x in range({i})]",
+                    f"def function_{i}(a,b = {i}):return a+b",
+                    f"result_{i} = {{'key':{i},'other' :[{i},{i + 1}]}}",
+                    f"print( 'line {i}' )",
+                )
+            )
+        )
+    return [f"{line}\n" for line in source[:-1]] + source[-1:]
+
+
+def make_outputs(rng: random.Random, output_size: int) -> List[Dict[str, Any]]:
+    if output_size <= 0:
+        return []
+    size = max(output_size * 3 // 4, 1)
+    payload = base64.b64encode(rng.getrandbits(8 * size).to_bytes(size, "little"))
+    return [
+        {"name": "stdout", "output_type": "stream", "text": ["output\n"]},
+        {
+            "data": {"image/png": payload.decode(), "text/plain": ["<Figure>"]},
+            "metadata": {"needs_background": "light"},
+            "output_type": "display_data",
+        },
+    ]
+
+
+def make_lab_file(
+    cells: int = 50,
+    cell_lines: int = 10,
+    output_size: int = 1000,
+    import_cells: float = 0.2,
+    shell_cells: float = 0.05,
+    empty_cells: float = 0.05,
+    seed: int = 0,
+) -> Dict[str, Any]:
+    """Generate a lab file.
+
+    :param int cells: number of cells, defaults to 50
+    :param int cell_lines: number of lines of each code cell, defaults to 10
+    :param int output_size: size in bytes of the image output of each code cell. 0 doesn't add outputs. Defaults to 1000
+    :param float import_cells: fraction of code cells that start with imports, defaults to 0.2
+    :param float shell_cells: fraction of code cells that are shell commands, defaults to 0.05
+    :param float empty_cells: fraction of cells that are empty, defaults to 0.05
+    :param int seed: seed of the random generator, defaults to 0
+    :return Dict[str, Any]: lab file
+    """
+    rng = random.Random(seed)
+    lab_cells: List[Dict[str, Any]] = []
+    for i in range(cells):
+        draw = rng.random()
+        if draw < empty_cells:
+            kind = "empty"
+        elif draw < empty_cells + shell_cells:
+            kind = "shell"
+        elif draw < empty_cells + shell_cells + import_cells:
+            kind = "import"
+        elif rng.random() < 0.2:
+            kind = "markdown"
+        else:
+            kind = "code"
+
+        if kind == "markdown":
+            lab_cells.append(
+                {"cell_type": "markdown", "metadata": {}, "source": [f"# Cell {i}"]}
+            )
+            continue
+        lab_cells.append(
+            {
+                "cell_type": "code",
+                "execution_count": i + 1,
+                "metadata": {"collapsed": False, "tags": ["generated"]},
+                "outputs": [] if kind == "empty" else make_outputs(rng, output_size),
+                "source": [] if kind == "empty" else make_source(rng, cell_lines, kind),
+            }
+        )
+    return {
+        "cells": lab_cells,
+        "metadata": {
+            "kernelspec": {"language": "python", "name": "python3"},
+            "language_info": {"name": "python", "version": "3.10.10"},
+        },
+        "nbformat": 4,
+        "nbformat_minor": 5,
+    }
+
+
+def write_corpus(directory: Path, notebooks: int, **kwargs: Any) -> List[Path]:
+    """Write lab files generated with make_lab_file() to a directory.
+
+    :param Path directory: directory
+    :param int notebooks: number of lab files
+    :return List[Path]: lab files
+    """
+    directory.mkdir(parents=True, exist_ok=True)
+    seed = kwargs.pop("seed", 0)
+    files = []
+    for i in range(notebooks):
+        file = directory / f"notebook_{i}.ipynb"
+        with open(file, "w") as f:
+            json.dump(make_lab_file(seed=seed + i, **kwargs), f, indent=1)
+        files.append(file)
+    return files
+
+
+def add_arguments(parser: argparse.ArgumentParser) -> None:
+    """Add the options of make_lab_file() and write_corpus() to a parser."""
+    parser.add_argument("--notebooks", type=int, default=20)
+    parser.add_argument("--cells", type=int, default=50)
+    parser.add_argument("--cell_lines", type=int, default=10)
+    parser.add_argument("--output_size", type=int, default=1000)
+    parser.add_argument("--import_cells", type=float, default=0.2)
+    parser.add_argument("--shell_cells", type=float, default=0.05)
+    parser.add_argument("--empty_cells", type=float, default=0.05)
+    parser.add_argument("--seed", type=int, default=0)
+
+
+def corpus_options(args: argparse.Namespace) -> Dict[str, Any]:
+    return {
+        "notebooks": args.notebooks,
+        "cells": args.cells,
+        "cell_lines": args.cell_lines,
+        "output_size": args.output_size,
+        "import_cells": args.import_cells,
+        "shell_cells": args.shell_cells,
+        "empty_cells": args.empty_cells,
+        "seed": args.seed,
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("directory", type=Path)
+    add_arguments(parser)
+    args = parser.parse_args()
+
+    files = write_corpus(args.directory, **corpus_options(args))
+    size = sum(file.stat().st_size for file in files)
+    print(f"wrote {len(files)} lab files ({size / 2**20:.1f} MB) to {args.directory}")
+
+
+if __name__ == "__main__":
+    main()
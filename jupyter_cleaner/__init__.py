@@ -0,0 +1,15 @@
+from jupyter_cleaner.jupyter_cleaner import CellContext
+from jupyter_cleaner.jupyter_cleaner import clean_notebook
+from jupyter_cleaner.jupyter_cleaner import CleanResult
+from jupyter_cleaner.jupyter_cleaner import Options
+from jupyter_cleaner.jupyter_cleaner import register_transform
+from jupyter_cleaner.jupyter_cleaner import run
+
+__all__ = [
+    "CellContext",
+    "clean_notebook",
+    "CleanResult",
+    "Options",
+    "register_transform",
+    "run",
+]
@@ -0,0 +1,253 @@
+"""Caching of lab files that are known to be clean, modelled on black's cache."""
+import hashlib
+import json
+import os
+import sqlite3
+import tempfile
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any
+from typing import Dict
+from typing import Iterable
+from typing import Optional
+from typing import Tuple
+
+CACHE_DIR_ENV = "JUPYTER_CLEANER_CACHE_DIR"
+TOOLS = ("jupyter-cleaner", "black", "reorder-python-imports")
+
+# (st_mtime, st_size, sha256 of the file contents)
+FileData = Tuple[float, int, str]
+
+
+def get_cache_dir() -> Path:
+    """Get the cache directory used by jupyter-cleaner.
+
+    The directory can be overridden with the JUPYTER_CLEANER_CACHE_DIR environment
+    variable, otherwise the user cache directory is used.
+
+    :return Path: cache directory
+    """
+    cache_dir = os.environ.get(CACHE_DIR_ENV)
+    if cache_dir:
+        return Path(cache_dir)
+    user_cache_dir = os.environ.get("XDG_CACHE_HOME") or Path.home() / ".cache"
+    return Path(user_cache_dir, "jupyter-cleaner")
+
+
+def get_tool_versions() -> Dict[str, str]:
+    """Versions of the tools that affect the formatted output.
+
+    :return Dict[str, str]: version of each tool, or "unknown" if it isn't installed
+    """
+    from importlib.metadata import PackageNotFoundError
+    from importlib.metadata import version
+
+    versions = {}
+    for tool in TOOLS:
+        try:
+            versions[tool] = version(tool)
+        except PackageNotFoundError:
+            versions[tool] = "unknown"
+    return versions
+
+
+def get_cache_key(options: Dict[str, Any]) -> str:
+    """Hash of the options and tool versions that determine the formatted output.
+
+    :param Dict[str, Any] options: options passed to run()
+    :return str: cache key
+    """
+    key = json.dumps(
+        {"options": options, "versions": get_tool_versions()},
+        sort_keys=True,
+        default=str,
+    )
+    return hashlib.sha256(key.encode()).hexdigest()[:16]
+
+
+def hash_file(file: Path) -> str:
+    """sha256 of the contents of a file.
+
+    :param Path file: file to hash
+    :return str: hex digest
+    """
+    with open(file, "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+class Cache:
+    """Lab files known to be clean for one set of options."""
+
+    def __init__(self, cache_file: Path, file_data: Dict[str, FileData]) -> None:
+        self.cache_file = cache_file
+        self.file_data = file_data
+
+    @classmethod
+    def read(cls, options: Dict[str, Any]) -> "Cache":
+        """Read the cache for a set of options, or return an empty cache.
+
+        :param Dict[str, Any] options: options passed to run()
+        :return Cache: cache of clean lab files
+        """
+        cache_file = get_cache_dir() / f"cache.{get_cache_key(options)}.json"
+        try:
+            with open(cache_file) as f:
+                file_data = {
+                    path: (mtime, size, file_hash)
+                    for path, (mtime, size, file_hash) in json.load(f).items()
+                }
+        except (OSError, ValueError, TypeError):
+            file_data = {}
+        return cls(cache_file, file_data)
+
+    def is_changed(self, file: Path) -> bool:
+        """Check if a lab file has changed since it was last formatted.
+
+        The modification time and size are checked first, so that the file only
+        needs to be read when its modification time changed.
+
+        :param Path file: lab file
+        :return bool: whether the file needs to be formatted
+        """
+        old = self.file_data.get(str(file.resolve()))
+        if old is None:
+            return True
+        stat = file.stat()
+        if stat.st_size != old[1]:
+            return True
+        if stat.st_mtime == old[0]:
+            return False
+        return hash_file(file) != old[2]
+
+    def write(self, files: Iterable[Path]) -> None:
+        """Record lab files as clean and save the cache.
+
+        :param Iterable[Path] files: lab files that are clean
+        """
+        for file in files:
+            stat = file.stat()
+            self.file_data[str(file.resolve())] = (
+                stat.st_mtime,
+                stat.st_size,
+                hash_file(file),
+            )
+        self.cache_file.parent.mkdir(parents=True, exist_ok=True)
+        with tempfile.NamedTemporaryFile(
+            "w", dir=self.cache_file.parent, delete=False
+        ) as f:
+            json.dump(self.file_data, f)
+        os.replace(f.name, self.cache_file)
+
+
+class CellCache:
+    """Formatted cell sources, with an in-process LRU and an optional persistent store.
+
+    Entries are keyed by a hash of the cell source and of the formatting mode.
+    """
+
+    def __init__(
+        self,
+        maxsize: int = 4096,
+        store: Optional[Path] = None,
+        max_store_size: int = 100 * 2**20,
+    ) -> None:
+        """
+        :param int maxsize: number of entries kept in memory
+        :param Optional[Path] store: sqlite database used to persist entries between runs, defaults to None
+        :param int max_store_size: size in bytes above which least recently used entries are evicted from the store
+        """
+        self.maxsize = maxsize
+        self.max_store_size = max_store_size
+        self.entries: "OrderedDict[str, str]" = OrderedDict()
+        self.accessed: Dict[str, float] = {}
+        self.connection: Optional[sqlite3.Connection] = None
+        if store is not None:
+            store.parent.mkdir(parents=True, exist_ok=True)
+            self.connection = sqlite3.connect(store, timeout=30)
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS cells (key TEXT PRIMARY KEY, source TEXT NOT NULL, size INTEGER NOT NULL, accessed REAL NOT NULL)"
+            )
+            self.connection.commit()
+
+    @staticmethod
+    def key(source: str, mode_key: str) -> str:
+        """Cache key of a cell source.
+
+        :param str source: cell source
+        :param str mode_key: key of the formatting mode, including the formatter version
+        :return str: cache key
+        """
+        return hashlib.sha256(f"{mode_key}\0{source}".encode()).hexdigest()
+
+    def get(self, key: str) -> Optional[str]:
+        """Get a formatted cell source.
+
+        :param str key: cache key
+        :return Optional[str]: formatted cell source, or None if it isn't cached
+        """
+        source = self.entries.get(key)
+        if source is not None:
+            self.entries.move_to_end(key)
+            return source
+        if self.connection is None:
+            return None
+        row = self.connection.execute(
+            "SELECT source FROM cells WHERE key = ?", (key,)
+        ).fetchone()
+        if row is None:
+            return None
+        self.accessed[key] = time.time()
+        self._remember(key, row[0])
+        return row[0]
+
+    def put(self, key: str, source: str) -> None:
+        """Add a formatted cell source.
+
+        :param str key: cache key
+        :param str source: formatted cell source
+        """
+        self._remember(key, source)
+        if self.connection is not None:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO cells VALUES (?, ?, ?, ?)",
+                (key, source, len(source.encode()), time.time()),
+            )
+
+    def _remember(self, key: str, source: str) -> None:
+        self.entries[key] = source
+        self.entries.move_to_end(key)
+        if len(self.entries) > self.maxsize:
+            self.entries.popitem(last=False)
+
+    def flush(self) -> None:
+        """Commit new entries and access times to the persistent store."""
+        if self.connection is None:
+            return
+        self.connection.executemany(
+            "UPDATE cells SET accessed = ? WHERE key = ?",
+            [(accessed, key) for key, accessed in self.accessed.items()],
+        )
+        self.accessed.clear()
+        self.connection.commit()
+
+    def evict(self) -> None:
+        """Remove least recently used entries until the store fits in max_store_size."""
+        if self.connection is None:
+            return
+        self.flush()
+        (size,) = self.connection.execute(
+            "SELECT COALESCE(SUM(size), 0) FROM cells"
+        ).fetchone()
+        if size <= self.max_store_size:
+            return
+        evicted = []
+        for key, entry_size in self.connection.execute(
+            "SELECT key, size FROM cells ORDER BY accessed"
+        ):
+            evicted.append((key,))
+            size -= entry_size
+            if size <= self.max_store_size:
+                break
+        self.connection.executemany("DELETE FROM cells WHERE key = ?", evicted)
+        self.connection.commit()
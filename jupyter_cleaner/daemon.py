@@ -0,0 +1,254 @@
+"""Long running server that cleans lab files, modelled on blackd.
+
+Starting jupyter-cleaner imports black and reorder-python-imports and starts with
+empty caches. The daemon pays these costs once, so that editors and pre-commit hooks
+can clean lab files in milliseconds with the thin client.
+
+Lab files are sent in the body of a POST request, with the options of clean_notebook()
+as a JSON object in the X-Jupyter-Cleaner-Options header. The daemon responds with:
+- 200 and the cleaned lab file when it was changed
+- 204 when the lab file is already clean
+- 400 when the lab file or the options are invalid
+- 500 when the lab file couldn't be cleaned
+"""
+import argparse
+import dataclasses
+import json
+import sys
+import threading
+from functools import partial
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler
+from http.server import ThreadingHTTPServer
+from pathlib import Path
+from typing import Any
+from typing import Dict
+from typing import List
+from typing import Optional
+from urllib.error import HTTPError
+from urllib.request import Request
+from urllib.request import urlopen
+
+from jupyter_cleaner.jupyter_cleaner import _report
+from jupyter_cleaner.jupyter_cleaner import _select_lab_files
+from jupyter_cleaner.jupyter_cleaner import _write_file
+from jupyter_cleaner.jupyter_cleaner import clean_notebook
+from jupyter_cleaner.jupyter_cleaner import get_inputs
+from jupyter_cleaner.jupyter_cleaner import Options
+
+OPTIONS_HEADER = "X-Jupyter-Cleaner-Options"
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 45485
+
+# Lab file cleaned when the daemon starts, so that black, reorder-python-imports and
+# their tables are loaded before the first request.
+_WARM_UP = {
+    "cells": [{"cell_type": "code", "metadata": {}, "source": ["import os\n", "os"]}],
+    "metadata": {"language_info": {"version": "3.8"}},
+}
+
+
+class _Handler(BaseHTTPRequestHandler):
+    # the cell cache isn't thread safe, so requests are cleaned one at a time
+    lock = threading.Lock()
+
+    def do_POST(self) -> None:
+        try:
+            options = Options(**json.loads(self.headers.get(OPTIONS_HEADER, "{}")))
+        except (TypeError, ValueError) as e:
+            self.respond(HTTPStatus.BAD_REQUEST, f"Invalid options: {e}")
+            return
+        contents = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+
+        try:
+            with self.lock:
+                result = clean_notebook(contents, options)
+        except ValueError as e:
+            self.respond(HTTPStatus.BAD_REQUEST, f"Invalid lab file: {e}")
+            return
+        except Exception as e:
+            self.respond(HTTPStatus.INTERNAL_SERVER_ERROR, f"{type(e).__name__}: {e}")
+            return
+
+        if result.changed:
+            self.respond(HTTPStatus.OK, result.contents)
+        else:
+            self.respond(HTTPStatus.NO_CONTENT, "")
+
+    def respond(self, status: HTTPStatus, body: str) -> None:
+        encoded = body.encode()
+        self.send_response(status)
+        if status != HTTPStatus.NO_CONTENT:
+            self.send_header("Content-Type", "application/json; charset=utf-8")
+            self.send_header("Content-Length", str(len(encoded)))
+        self.end_headers()
+        if status != HTTPStatus.NO_CONTENT:
+            self.wfile.write(encoded)
+
+    def log_message(self, format: str, *args: Any) -> None:
+        pass
+
+
+def make_server(
+    host: str = DEFAULT_HOST, port: int = DEFAULT_PORT
+) -> ThreadingHTTPServer:
+    """Create the daemon, with black and reorder-python-imports already loaded.
+
+    :param str host: address to listen on, defaults to localhost
+    :param int port: port to listen on. 0 uses any free port
+    :return ThreadingHTTPServer: server, started with serve_forever()
+    """
+    clean_notebook(json.loads(json.dumps(_WARM_UP)))
+    return ThreadingHTTPServer((host, port), _Handler)
+
+
+def clean_file(
+    file: Path,
+    options: Dict[str, Any],
+    host: str = DEFAULT_HOST,
+    port: int = DEFAULT_PORT,
+    timeout: float = 60,
+    check: bool = False,
+) -> bool:
+    """Clean a lab file with the daemon.
+
+    :param Path file: lab file
+    :param Dict[str, Any] options: options of clean_notebook()
+    :param str host: address of the daemon, defaults to localhost
+    :param int port: port of the daemon
+    :param float timeout: seconds to wait for the daemon, defaults to 60
+    :param bool check: don't write the lab file back, defaults to False
+    :raises ValueError: when the daemon couldn't clean the lab file
+    :return bool: whether the file was rewritten, or would be rewritten with `check`
+    """
+    request = Request(
+        f"http://{host}:{port}/",
+        data=file.read_bytes(),
+        headers={OPTIONS_HEADER: json.dumps(options)},
+        method="POST",
+    )
+    try:
+        with urlopen(request, timeout=timeout) as response:
+            if response.status == HTTPStatus.NO_CONTENT:
+                return False
+            contents = response.read().decode()
+    except HTTPError as e:
+        raise ValueError(e.read().decode() or e.reason) from None
+
+    if not check:
+        _write_file(file, contents, "none")
+    return True
+
+
+def daemon(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(
+        description="Serve jupyter-cleaner over HTTP, keeping formatters and caches warm"
+    )
+    parser.add_argument(
+        "--bind_host",
+        type=str,
+        default=DEFAULT_HOST,
+        help=f"Address to listen on. Defaults to {DEFAULT_HOST}",
+    )
+    parser.add_argument(
+        "--bind_port",
+        type=int,
+        default=DEFAULT_PORT,
+        help=f"Port to listen on. Defaults to {DEFAULT_PORT}",
+    )
+    args = parser.parse_args(argv)
+
+    server = make_server(args.bind_host, args.bind_port)
+    print(f"jupyter-cleaner daemon listening on {args.bind_host}:{args.bind_port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+def client(argv: Optional[List[str]] = None) -> None:
+    """Clean lab files with the daemon. Apart from the address of the daemon, the
+    arguments and the options in pyproject.toml are those of jupyter-cleaner.
+
+    :param Optional[List[str]] argv: command line arguments, defaults to sys.argv
+    """
+    # --help is left to the parser of jupyter-cleaner
+    parser = argparse.ArgumentParser(add_help=False)
+    parser.add_argument(
+        "--bind_host",
+        type=str,
+        default=DEFAULT_HOST,
+        help=f"Address of the daemon. Defaults to {DEFAULT_HOST}",
+    )
+    parser.add_argument(
+        "--bind_port",
+        type=int,
+        default=DEFAULT_PORT,
+        help=f"Port of the daemon. Defaults to {DEFAULT_PORT}",
+    )
+    args, argv = parser.parse_known_args(argv)
+
+    (
+        files_or_dirs,
+        execution_count,
+        remove_outputs,
+        format,
+        reorder_imports,
+        indent_level,
+        exclude_files_or_dirs,
+        remove_empty_cells,
+        clear_cell_metadata,
+        preserve_cell_metadata,
+        ignore_fails,
+        _,  # jobs
+        _,  # cache
+        _,  # cache_max_size
+        fast,
+        verify_every,
+        verify_length_change,
+        changed_since,
+        staged,
+        _,  # fsync
+        check,
+        prune_dirs,
+        ignore_gitignore,
+        *_,  # profile, profile_output, json_backend, verbose, prefetch and max_memory
+    ) = get_inputs(argv)
+    options = dataclasses.asdict(
+        Options(
+            execution_count=execution_count,
+            remove_outputs=remove_outputs,
+            format=format,
+            reorder_imports=reorder_imports,
+            indent_level=indent_level,
+            remove_empty_cells=remove_empty_cells,
+            clear_cell_metadata=clear_cell_metadata,
+            preserve_cell_metadata=preserve_cell_metadata,
+            fast=fast,
+            verify_every=verify_every,
+            verify_length_change=verify_length_change,
+        )
+    )
+
+    changed_files = []
+    for file in _select_lab_files(
+        files_or_dirs,
+        exclude_files_or_dirs,
+        changed_since,
+        staged,
+        prune_dirs,
+        ignore_gitignore,
+    ):
+        if _report(
+            file,
+            partial(
+                clean_file, file, options, args.bind_host, args.bind_port, check=check
+            ),
+            ignore_fails,
+            check,
+        ):
+            changed_files.append(file)
+    if check and changed_files:
+        sys.exit(1)
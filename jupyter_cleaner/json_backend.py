@@ -0,0 +1,126 @@
+"""Parsing and serialisation of lab files with json or orjson.
+
+orjson is much faster than json, especially when serialising with an indent, where
+json falls back to its pure Python encoder. Its output is made byte-identical to
+`json.dumps(data, indent=indent)`, so that switching backends doesn't change the
+lab files that are written:
+- orjson only indents with 2 spaces, so lines are re-indented
+- json escapes non-ASCII characters (and DEL), which orjson writes as UTF-8
+- json and orjson format floats differently, and orjson writes NaN and infinity as
+  null, so lab files that contain floats are serialised with json
+
+orjson is optional. When it isn't installed, or can't serialise a lab file (e.g.
+integers larger than 64 bits), json is used.
+"""
+import json
+import re
+from functools import lru_cache
+from typing import Any
+from typing import Dict
+from typing import Match
+from typing import Union
+
+BACKENDS = ("auto", "json", "orjson")
+
+# types that orjson serialises as json does. Containers are checked recursively
+_SUPPORTED_TYPES = {str, int, bool, type(None), dict, list}
+_NON_ASCII = re.compile("[\x7f-\U0010ffff]")
+
+
+@lru_cache(maxsize=None)
+def get_backend(backend: str) -> str:
+    """Resolve the backend to use.
+
+    :param str backend: "auto" uses orjson if it is installed, otherwise json
+    :raises ValueError: when the backend is unknown, or orjson isn't installed
+    :return str: "json" or "orjson"
+    """
+    if backend not in BACKENDS:
+        raise ValueError(f"json_backend must be one of {', '.join(BACKENDS)}")
+    if backend == "json":
+        return backend
+    try:
+        import orjson  # noqa: F401
+    except ImportError:
+        if backend == "orjson":
+            raise ValueError("json_backend orjson requires orjson to be installed")
+        return "json"
+    return "orjson"
+
+
+def loads(contents: Union[bytes, str], backend: str = "auto") -> Any:
+    """Parse JSON.
+
+    :param Union[bytes, str] contents: JSON
+    :param str backend: JSON backend, defaults to "auto"
+    :raises json.JSONDecodeError: when the contents aren't valid JSON
+    :return Any: parsed JSON
+    """
+    if get_backend(backend) == "orjson":
+        import orjson
+
+        try:
+            return orjson.loads(contents)
+        except orjson.JSONDecodeError:
+            # NaN, infinity and integers larger than 64 bits are only parsed by json,
+            # which also raises the same errors as the json backend
+            pass
+    return json.loads(contents)
+
+
+def dumps(data: Dict[str, Any], indent: int, backend: str = "auto") -> str:
+    """Serialise a lab file as `json.dumps(data, indent=indent)` does.
+
+    :param Dict[str, Any] data: lab file
+    :param int indent: indent level. 0 or negative only inserts newlines
+    :param str backend: JSON backend, defaults to "auto"
+    :return str: serialised lab file
+    """
+    if get_backend(backend) == "orjson" and not _has_floats(data):
+        import orjson
+
+        try:
+            contents = orjson.dumps(data, option=orjson.OPT_INDENT_2)
+        except TypeError:
+            pass
+        else:
+            return _to_json_format(contents, indent)
+    return json.dumps(data, indent=indent)
+
+
+def _has_floats(data: Any) -> bool:
+    """Check if data contains floats, or types that orjson may serialise differently from json."""
+    stack = [data]
+    while stack:
+        container = stack.pop()
+        values = container.values() if type(container) is dict else container
+        # map() keeps the check in C for the long lists of strings in cell sources
+        types = set(map(type, values))
+        if not types <= _SUPPORTED_TYPES:
+            return True
+        if dict in types or list in types:
+            stack.extend(v for v in values if type(v) is dict or type(v) is list)
+    return False
+
+
+def _to_json_format(contents: bytes, indent: int) -> str:
+    """Convert the output of orjson with OPT_INDENT_2 to the output of json."""
+    if indent != 2:
+        # strings can't contain newlines, so every line starts with its indent
+        width = max(indent, 0)
+        lines = []
+        for line in contents.split(b"\n"):
+            stripped = line.lstrip(b" ")
+            lines.append(b" " * ((len(line) - len(stripped)) // 2 * width) + stripped)
+        contents = b"\n".join(lines)
+    if contents.isascii() and b"\x7f" not in contents:
+        return contents.decode("ascii")
+    return _NON_ASCII.sub(_escape, contents.decode())
+
+
+def _escape(match: Match[str]) -> str:
+    code = ord(match.group())
+    if code < 0x10000:
+        return f"\\u{code:04x}"
+    code -= 0x10000
+    return f"\\u{0xD800 | (code >> 10):04x}\\u{0xDC00 | (code & 0x3FF):04x}"
@@ -1,25 +1,42 @@
 import argparse
-import json
+import contextlib
+import dataclasses
+import errno
+import os
 import re
+import stat
+import subprocess
 import sys
+import tempfile
+import time
+from collections import deque
+from dataclasses import dataclass
 from functools import lru_cache
+from functools import partial
 from pathlib import Path
 from typing import Any
+from typing import Callable
+from typing import Deque
 from typing import Dict
+from typing import Generator
 from typing import List
 from typing import Optional
 from typing import Sequence
+from typing import Set
 from typing import Tuple
 from typing import TYPE_CHECKING
 from typing import Union
 
-import black
-from reorder_python_imports import _validate_replace_import
-from reorder_python_imports import fix_file_contents
-from reorder_python_imports import import_obj_from_str
-from reorder_python_imports import REMOVALS
-from reorder_python_imports import Replacements
-from reorder_python_imports import REPLACES
+from jupyter_cleaner import reader
+from jupyter_cleaner.cache import Cache
+from jupyter_cleaner.cache import CellCache
+from jupyter_cleaner.cache import get_cache_dir
+from jupyter_cleaner.cache import get_tool_versions
+from jupyter_cleaner.json_backend import BACKENDS as JSON_BACKENDS
+from jupyter_cleaner.json_backend import dumps as dump_json
+from jupyter_cleaner.json_backend import get_backend as get_json_backend
+from jupyter_cleaner.profiling import phase
+from jupyter_cleaner.profiling import Profile
 
 if sys.version_info >= (3, 11):
     try:
@@ -31,6 +48,78 @@ if sys.version_info >= (3, 11):
 else:
     import tomli as tomllib
 
+FSYNC_POLICIES = ("none", "always", "batch")
+# peak memory of cleaning a lab file, as a multiple of its size. Measured at 7 times
+# for lab files with large outputs and 13 times for lab files with many small cells.
+NOTEBOOK_MEMORY_FACTOR = 15
+# peak memory for each quote in a lab file whose outputs are removed without being
+# decoded. Measured at 120 to 170 bytes on top of the size of the lab file.
+MEMORY_PER_QUOTE = 200
+# directories that aren't searched for lab files, from black's default excludes
+PRUNE_DIRS = (
+    ".direnv",
+    ".eggs",
+    ".git",
+    ".hg",
+    ".ipynb_checkpoints",
+    ".mypy_cache",
+    ".nox",
+    ".pytest_cache",
+    ".ruff_cache",
+    ".svn",
+    ".tox",
+    ".venv",
+    ".vscode",
+    "__pypackages__",
+    "_build",
+    "buck-out",
+    "build",
+    "dist",
+    "node_modules",
+    "venv",
+)
+
+if TYPE_CHECKING:
+    # black and reorder-python-imports are slow to import, so they are only
+    # imported once a cell needs to be formatted.
+    from concurrent.futures import Future
+
+    import black
+    from pathspec import GitIgnoreSpec
+    from reorder_python_imports import Replacements
+
+
+@dataclass(frozen=True)
+class Options:
+    """Options that determine how a lab file is cleaned. See run() for a description of each option."""
+
+    execution_count: int = 0
+    remove_outputs: bool = True
+    format: bool = True
+    reorder_imports: bool = True
+    indent_level: int = 4
+    remove_empty_cells: bool = True
+    clear_cell_metadata: bool = True
+    preserve_cell_metadata: Sequence[str] = ()
+    black_config: Optional[Dict[str, str]] = None
+    fast: bool = False
+    verify_every: int = 0
+    verify_length_change: float = 0
+
+
+@dataclass
+class CleanResult:
+    """A cleaned lab file."""
+
+    notebook: Dict[str, Any]
+    changed: bool
+    indent_level: int = 4
+
+    @property
+    def contents(self) -> str:
+        """The cleaned lab file serialised as it would be written by run()."""
+        return dump_json(self.notebook, self.indent_level) + "\n"
+
 
 def run(
     files: Sequence[Path],
@@ -45,7 +134,21 @@ def run(
     preserve_cell_metadata: Sequence[str] = [],
     ignore_fails: bool = False,
     black_config: Optional[Dict[str, str]] = None,
-) -> None:
+    jobs: int = 1,
+    cache: bool = False,
+    cache_max_size: int = 100,
+    fast: bool = False,
+    verify_every: int = 0,
+    verify_length_change: float = 0,
+    fsync: str = "none",
+    check: bool = False,
+    profile: bool = False,
+    profile_output: Optional[Path] = None,
+    json_backend: str = "auto",
+    verbose: bool = False,
+    prefetch: int = 0,
+    max_memory: int = 0,
+) -> List[Path]:
     """Format Jupyter lab files.
 
     :param Sequence[Path] files: file(s) to be formatted
@@ -58,130 +161,1038 @@ def run(
     :param bool remove_empty_cells: remove empty cells from notebook.
     :param bool clear_cell_metadata: remove metadata from cells from notebook.
     :param Optional[Dict[str, str]] black_config: configuration from black formatting, defaults to None
+    :param int jobs: number of notebooks to format in parallel processes. 0 or a negative integer uses all available CPUs. Defaults to 1.
+    :param bool cache: skip files that are unchanged since they were last formatted with the same options, and persist formatted cells between runs, defaults to False
+    :param int cache_max_size: maximum size of the persistent cache of formatted cells in megabytes, defaults to 100
+    :param bool fast: skip black's check that the formatted code is equivalent to the original code, defaults to False
+    :param int verify_every: when `fast` is set, still check every nth formatted cell of a lab file. 0 doesn't check any cells. Defaults to 0.
+    :param float verify_length_change: when `fast` is set, still check cells whose length changed by more than this fraction. 0 doesn't check any cells. Defaults to 0.
+    :param str fsync: when to flush rewritten files to disk. "none" leaves it to the operating system, "always" flushes every file and its directory, and "batch" flushes every file and each directory once at the end. Defaults to "none".
+    :param bool check: don't write the lab files back, only report the lab files that would be reformatted, defaults to False
+    :param bool profile: print the wall and CPU time taken by each phase, and the slowest lab files and cells, defaults to False
+    :param Optional[Path] profile_output: with `profile`, also write a JSON report of all timings to this file, defaults to None
+    :param str json_backend: library used to parse and serialise lab files: "json", "orjson", or "auto" to use orjson if it is installed. The written lab files are identical with either library. Defaults to "auto".
+    :param bool verbose: print how many cells each transform reused from cells with the same source, in this run or cached from earlier runs, defaults to False
+    :param int prefetch: with one job, read this many lab files ahead on I/O threads and write cleaned lab files on another thread, so that reading and writing overlap with cleaning. 0 reads, cleans and writes each lab file in turn. Defaults to 0.
+    :param int max_memory: with more than one job, memory budget in megabytes for the lab files cleaned at the same time, estimated from their sizes and, when outputs are removed, the number of quotes in them. Lab files are cleaned largest first, and a lab file larger than the budget is cleaned on its own. 0 doesn't limit memory. Defaults to 0.
     :raises TypeError: when file input is unrecognised
+    :return List[Path]: lab files that were reformatted, or that would be reformatted with `check`
     """
-    if black_config is None:
-        black_config = {}
+    if fsync not in FSYNC_POLICIES:
+        raise ValueError(f"fsync must be one of {', '.join(FSYNC_POLICIES)}")
+    json_backend = get_json_backend(json_backend)
 
-    for file in files:
-        try:
-            if (
-                not file.is_file()
-                or not file.exists()
-                or file.suffix != ".ipynb"
-                or file in exclude_files
+    exclude = set(exclude_files)
+    files = [
+        file
+        for file in files
+        if file.is_file()
+        and file.exists()
+        and file.suffix == ".ipynb"
+        and file not in exclude
+    ]
+    options = Options(
+        execution_count=execution_count,
+        remove_outputs=remove_outputs,
+        format=format,
+        reorder_imports=reorder_imports,
+        indent_level=indent_level,
+        remove_empty_cells=remove_empty_cells,
+        clear_cell_metadata=clear_cell_metadata,
+        preserve_cell_metadata=preserve_cell_metadata,
+        black_config=black_config,
+        fast=fast,
+        verify_every=verify_every,
+        verify_length_change=verify_length_change,
+    )
+    cell_store = get_cache_dir() / "cells.sqlite" if cache else None
+    clean_file = partial(
+        _clean_file,
+        options=options,
+        cell_store=cell_store,
+        cell_store_size=cache_max_size * 2**20,
+        fsync=fsync,
+        check=check,
+        json_backend=json_backend,
+    )
+    notebook_cache = Cache.read(dataclasses.asdict(options)) if cache else None
+    if notebook_cache is not None:
+        files = [file for file in files if notebook_cache.is_changed(file)]
+
+    if jobs <= 0:
+        jobs = os.cpu_count() or 1
+    if sys.platform == "win32":
+        # ProcessPoolExecutor doesn't support more than 61 workers on Windows
+        jobs = min(jobs, 61)
+    run_profile = Profile() if profile or verbose else None
+    if (jobs == 1 or len(files) < 2) and prefetch > 0:
+        clean_contents = partial(
+            _clean_contents,
+            options=options,
+            cell_store=cell_store,
+            cell_store_size=cache_max_size * 2**20,
+            check=check,
+            json_backend=json_backend,
+        )
+        results = _run_pipeline(
+            files, clean_contents, prefetch, fsync, ignore_fails, check, run_profile
+        )
+    elif jobs == 1 or len(files) < 2:
+        results = [
+            (
+                file,
+                _report(
+                    file,
+                    partial(clean_file, file, profile=run_profile),
+                    ignore_fails,
+                    check,
+                ),
+            )
+            for file in files
+        ]
+    else:
+        from concurrent.futures import ProcessPoolExecutor
+
+        # Notebooks are formatted out of order by the pool, but results are
+        # reported in the order of `files` so that the output is deterministic.
+        with ProcessPoolExecutor(max_workers=min(jobs, len(files))) as executor:
+
+            def submit(file: Path) -> "Future[Any]":
+                if run_profile is None:
+                    return executor.submit(clean_file, file)
+                return executor.submit(_clean_file_with_profile, clean_file, file)
+
+            with contextlib.closing(
+                _schedule(files, submit, max_memory * 2**20, remove_outputs)
+            ) as scheduled:
+                results = [
+                    (
+                        file,
+                        _report(
+                            file,
+                            future.result
+                            if run_profile is None
+                            else partial(_merge_profile, run_profile, future.result),
+                            ignore_fails,
+                            check,
+                        ),
+                    )
+                    for file, future in scheduled
+                ]
+
+    if fsync == "batch" and not check:
+        for directory in {
+            file.resolve().parent for file, changed in results if changed
+        }:
+            _fsync_directory(directory)
+    if notebook_cache is not None:
+        # with `check`, lab files that would be reformatted aren't clean
+        notebook_cache.write(
+            [
+                file
+                for file, changed in results
+                if changed is not None and not (check and changed)
+            ]
+        )
+    if cell_store is not None:
+        _get_cell_cache(cell_store, cache_max_size * 2**20, os.getpid()).evict()
+    if profile and run_profile is not None:
+        print(run_profile.summary())
+        if profile_output is not None:
+            run_profile.write(profile_output)
+    elif verbose and run_profile is not None and run_profile.dedup:
+        print(run_profile.dedup_summary())
+    return [file for file, changed in results if changed]
+
+
+def clean_notebook(
+    notebook: Union[Dict[str, Any], bytes, str],
+    options: Optional[Options] = None,
+    timings: Optional[Dict[str, float]] = None,
+) -> CleanResult:
+    """Clean a Jupyter lab file in memory, without reading or writing files.
+
+    A parsed lab file is cleaned in place. Formatted cells are cached for the
+    lifetime of the process, so that editors and other long running tools can call
+    this repeatedly.
+
+    :param Union[Dict[str, Any], bytes, str] notebook: parsed lab file, or the contents of a lab file. Contents are changed when the cleaned lab file serialises to different bytes, e.g. when only the indent level differs.
+    :param Optional[Options] options: cleaning options, defaults to Options()
+    :param Optional[Dict[str, float]] timings: seconds spent in each transform are added to this, defaults to None
+    :raises json.JSONDecodeError: when the contents of the lab file aren't valid JSON
+    :return CleanResult: cleaned lab file and whether it was changed
+    """
+    if options is None:
+        options = Options()
+    changed = False
+    original = None
+    if isinstance(notebook, str):
+        notebook = notebook.encode()
+    if isinstance(notebook, bytes):
+        original = notebook
+        notebook, changed = reader.loads(original, skip_outputs=options.remove_outputs)
+    changed = (
+        _clean_cells(
+            notebook,
+            options,
+            _get_cell_cache(None, 0, os.getpid()),
+            timings=timings,
+        )
+        or changed
+    )
+    result = CleanResult(notebook, changed, options.indent_level)
+    if original is not None:
+        # in memory, so compared without the newlines of the platform
+        result.changed = result.contents.encode() != original
+    return result
+
+
+def _report(
+    file: Path, clean_file: Callable[[], bool], ignore_fails: bool, check: bool = False
+) -> Optional[bool]:
+    """Clean a single file and print the outcome.
+
+    :param Path file: file being formatted
+    :param Callable[[], bool] clean_file: formats the file and returns whether it was changed
+    :param bool ignore_fails: continue execution despite failures
+    :param bool check: the file isn't written back, defaults to False
+    :return Optional[bool]: whether the file was changed, or None if formatting failed
+    """
+    try:
+        changed = clean_file()
+    except Exception as e:
+        print(f"Reformatting failed: {str(file)}")
+        if not ignore_fails:
+            raise e
+        return None
+    if changed:
+        print(f"{'Would reformat' if check else 'Reformatted'} {str(file)}")
+    return changed
+
+
+def _encode(contents: str) -> bytes:
+    """Bytes written by _write_file(), which writes in text mode.
+
+    :param str contents: contents of a lab file
+    :return bytes: encoded contents, with the newlines of the platform
+    """
+    return contents.replace("\n", os.linesep).encode()
+
+
+def _write_file(file: Path, contents: str, fsync: str) -> None:
+    """Atomically replace the contents of a file.
+
+    The contents are written to a temporary file in the same directory, which then
+    replaces the file, so that an interrupted write never leaves a truncated file.
+
+    :param Path file: file to write
+    :param str contents: new contents
+    :param str fsync: fsync policy, see run()
+    :raises PermissionError: when the file is read-only
+    """
+    file = file.resolve()  # replace the target of symbolic links
+    # replacing the file only needs permission to write to its directory
+    if not os.access(file, os.W_OK):
+        raise PermissionError(errno.EACCES, os.strerror(errno.EACCES), str(file))
+    fd, tmp_file = tempfile.mkstemp(
+        dir=file.parent, prefix=f".{file.name}.", suffix=".tmp"
+    )
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            f.write(contents)
+            if fsync != "none":
+                f.flush()
+                os.fsync(f.fileno())
+        os.chmod(tmp_file, stat.S_IMODE(file.stat().st_mode))
+        os.replace(tmp_file, file)
+    except BaseException:
+        with contextlib.suppress(OSError):
+            os.unlink(tmp_file)
+        raise
+    if fsync == "always":
+        _fsync_directory(file.parent)
+
+
+def _fsync_directory(directory: Path) -> None:
+    """Flush a directory to disk, so that renamed files in it are durable.
+
+    :param Path directory: directory to flush
+    """
+    if not hasattr(os, "O_DIRECTORY"):
+        return  # directories can't be opened on Windows
+    fd = os.open(directory, os.O_RDONLY | os.O_DIRECTORY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def _clean_file(
+    file: Path,
+    options: "Options",
+    cell_store: Optional[Path] = None,
+    cell_store_size: int = 0,
+    fsync: str = "none",
+    check: bool = False,
+    profile: Optional[Profile] = None,
+    json_backend: str = "auto",
+) -> bool:
+    """Format a single Jupyter lab file. See run() for a description of the parameters.
+
+    :param Path file: lab file
+    :param Options options: cleaning options
+    :param Optional[Path] cell_store: persistent store of formatted cells, defaults to None
+    :param int cell_store_size: size in bytes of the persistent store of formatted cells
+    :param Optional[Profile] profile: timings of each phase are added to this, defaults to None
+    :return bool: whether the file was rewritten, or would be rewritten with `check`
+    """
+    with contextlib.nullcontext() if profile is None else profile.notebook(file):
+        with phase(profile, "read"):
+            original = file.read_bytes()
+        changed, contents = _clean_contents(
+            original,
+            options,
+            cell_store,
+            cell_store_size,
+            check,
+            profile,
+            json_backend,
+        )
+        if contents is None:
+            return changed
+        with phase(profile, "write"):
+            _write_file(file, contents, fsync)
+        return True
+
+
+def _clean_contents(
+    original: bytes,
+    options: "Options",
+    cell_store: Optional[Path] = None,
+    cell_store_size: int = 0,
+    check: bool = False,
+    profile: Optional[Profile] = None,
+    json_backend: str = "auto",
+) -> Tuple[bool, Optional[str]]:
+    """Clean the contents of a lab file, without reading or writing it. See _clean_file().
+
+    :param bytes original: contents of the lab file
+    :param Options options: cleaning options
+    :param Optional[Path] cell_store: persistent store of formatted cells, defaults to None
+    :param int cell_store_size: size in bytes of the persistent store of formatted cells
+    :param Optional[Profile] profile: timings of each phase are added to this, defaults to None
+    :return Tuple[bool, Optional[str]]: whether the lab file changed, and the contents to write unless it's unchanged or with `check`
+    """
+    cell_cache = _get_cell_cache(cell_store, cell_store_size, os.getpid())
+    try:
+        with phase(profile, "parse"):
+            data, changed = reader.loads(
+                original, skip_outputs=options.remove_outputs, backend=json_backend
+            )
+        if not (check and changed):
+            changed = (
+                _clean_cells(data, options, cell_cache, check, profile=profile)
+                or changed
+            )
+    finally:
+        cell_cache.flush()
+    if check and changed:
+        return True, None
+
+    # the lab file is only rewritten when its bytes change, so that its
+    # modification time is kept when it's already clean. This also rewrites lab
+    # files that are only formatted differently, e.g. with another indent level.
+    with phase(profile, "serialize"):
+        contents = dump_json(data, options.indent_level, json_backend) + "\n"
+        changed = _encode(contents) != original
+    return changed, contents if changed and not check else None
+
+
+def _clean_file_with_profile(
+    clean_file: Callable[..., bool], file: Path
+) -> Tuple[bool, Profile]:
+    """Clean a lab file in another process, returning the timings of that process.
+
+    :param Callable[..., bool] clean_file: _clean_file() with the options of run()
+    :param Path file: lab file
+    :return Tuple[bool, Profile]: whether the file was changed, and its timings
+    """
+    profile = Profile()
+    return clean_file(file, profile=profile), profile
+
+
+def _merge_profile(
+    profile: Profile, result: Callable[[], Tuple[bool, Profile]]
+) -> bool:
+    """Add the timings of a lab file cleaned in another process.
+
+    :param Profile profile: timings of the run
+    :param Callable[[], Tuple[bool, Profile]] result: result of _clean_file_with_profile()
+    :return bool: whether the file was changed
+    """
+    changed, other = result()
+    profile.merge(other)
+    return changed
+
+
+def _estimate_memory(file: Path, remove_outputs: bool = False) -> int:
+    """Estimate the peak memory needed to clean a lab file.
+
+    Without `remove_outputs`, the estimate is proportional to the size of the lab
+    file. Removed outputs are never decoded, so lab files with large outputs need
+    little more than their size. The objects decoded from the rest of the lab file
+    are estimated from the number of quotes, which is counted in chunks.
+
+    :param Path file: lab file
+    :param bool remove_outputs: outputs of cells are removed, defaults to False
+    :return int: estimated memory in bytes
+    """
+    try:
+        size = file.stat().st_size
+        if not remove_outputs:
+            return size * NOTEBOOK_MEMORY_FACTOR
+        quotes = 0
+        with open(file, "rb") as f:
+            for chunk in iter(partial(f.read, 2**20), b""):
+                quotes += chunk.count(b'"')
+    except OSError:
+        return 0  # the error is reported when the lab file is cleaned
+    return min(size + quotes * MEMORY_PER_QUOTE, size * NOTEBOOK_MEMORY_FACTOR)
+
+
+def _schedule(
+    files: Sequence[Path],
+    submit: Callable[[Path], "Future[Any]"],
+    max_memory: int = 0,
+    remove_outputs: bool = False,
+) -> Generator[Tuple[Path, "Future[Any]"], None, None]:
+    """Submit lab files to a process pool, largest first and within a memory budget.
+
+    Lab files are submitted while the estimated memory of the lab files in the pool
+    fits in `max_memory`. A lab file that doesn't fit is only submitted once the
+    pool is empty, so that two lab files larger than half of the budget never run
+    at the same time. Submitting the largest lab files first keeps them from
+    finishing last, after the pool has run out of other work.
+
+    :param Sequence[Path] files: lab files
+    :param Callable[[Path], Future[Any]] submit: submits a lab file to the pool
+    :param int max_memory: memory budget in bytes. 0 submits all lab files at once
+    :param bool remove_outputs: outputs of cells are removed, see _estimate_memory(). Defaults to False
+    :return Generator[Tuple[Path, Future[Any]], None, None]: each lab file and its finished future, in the order of `files`
+    """
+    from concurrent.futures import FIRST_COMPLETED
+    from concurrent.futures import wait
+
+    # sizes are enough to order lab files, so they are only read with a budget
+    remove_outputs = remove_outputs and max_memory > 0
+    estimates = [_estimate_memory(file, remove_outputs) for file in files]
+    queue = deque(sorted(range(len(files)), key=estimates.__getitem__, reverse=True))
+    futures: Dict[int, "Future[Any]"] = {}
+    running: Dict["Future[Any]", int] = {}
+    used = 0
+    reported = 0
+    try:
+        while reported < len(files):
+            while queue and (
+                not running
+                or max_memory <= 0
+                or used + estimates[queue[0]] <= max_memory
             ):
-                continue
+                index = queue.popleft()
+                futures[index] = submit(files[index])
+                running[futures[index]] = index
+                used += estimates[index]
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                used -= estimates[running.pop(future)]
+            while reported in futures and futures[reported].done():
+                yield files[reported], futures.pop(reported)
+                reported += 1
+    finally:
+        for future in futures.values():
+            future.cancel()
+
+
+# whether a lab file changed, and the wall and CPU seconds taken to write it, if it was
+PipelineOutcome = Tuple[bool, Optional[Tuple[float, float]]]
+
 
-            with open(file) as f:
-                data = json.load(f)
-                python_version = data["metadata"]["language_info"]["version"]
-                min_python_version = tuple(
-                    map(int, re.findall(r"(\d+)", python_version))
-                )
-                if len(min_python_version) > 2:
-                    min_python_version = min_python_version[:2]
-
-                for cell in data["cells"]:
-                    is_code = cell["cell_type"] == "code"
-                    is_source = "source" in cell.keys()
-                    is_source_empty = len(cell["source"]) == 0
-                    is_shell_command = (
-                        is_code
-                        and is_source
-                        and not is_source_empty
-                        and cell["source"][0].strip() == "!"
+def _run_pipeline(
+    files: Sequence[Path],
+    clean_contents: Callable[..., Tuple[bool, Optional[str]]],
+    prefetch: int,
+    fsync: str,
+    ignore_fails: bool,
+    check: bool,
+    profile: Optional[Profile] = None,
+) -> List[Tuple[Path, Optional[bool]]]:
+    """Clean lab files in a pipeline that overlaps reading and writing with cleaning.
+
+    The next `prefetch` lab files are read on I/O threads while a lab file is
+    cleaned, and cleaned lab files are written on another thread. At most `prefetch`
+    lab files are read ahead, and at most `prefetch` are waiting to be written, so
+    that memory stays bounded when cleaning is faster or slower than the disk.
+
+    :param Sequence[Path] files: lab files
+    :param Callable[..., Tuple[bool, Optional[str]]] clean_contents: _clean_contents() with the options of run()
+    :param int prefetch: number of lab files to read ahead and to write behind
+    :param str fsync: fsync policy, see run()
+    :param bool ignore_fails: continue execution despite failures
+    :param bool check: the lab files aren't written back
+    :param Optional[Profile] profile: timings of each phase are added to this, defaults to None
+    :return List[Tuple[Path, Optional[bool]]]: each lab file and whether it was changed, or None if cleaning it failed, in the order of `files`
+    """
+    from concurrent.futures import Future
+    from concurrent.futures import ThreadPoolExecutor
+
+    results: List[Tuple[Path, Optional[bool]]] = []
+    # cleaned lab files, which are reported in order once they are written
+    pending: Deque[Tuple[Path, "Future[PipelineOutcome]"]] = deque()
+
+    def report_oldest() -> None:
+        file, outcome = pending.popleft()
+        results.append(
+            (
+                file,
+                _report(
+                    file,
+                    partial(_pipeline_outcome, outcome, profile),
+                    ignore_fails,
+                    check,
+                ),
+            )
+        )
+
+    readers = ThreadPoolExecutor(prefetch, thread_name_prefix="jupyter-cleaner-read")
+    writer = ThreadPoolExecutor(1, thread_name_prefix="jupyter-cleaner-write")
+    with readers, writer:
+        reads = deque(
+            readers.submit(_timed, file.read_bytes) for file in files[:prefetch]
+        )
+        try:
+            for index, file in enumerate(files):
+                read = reads.popleft()
+                if index + prefetch < len(files):
+                    reads.append(
+                        readers.submit(_timed, files[index + prefetch].read_bytes)
                     )
-                    is_metadata = "metadata" in cell.keys()
-
-                    if remove_empty_cells and is_source and is_source_empty:
-                        data["cells"].remove(cell)
-                        continue
-
-                    if execution_count >= 0 and "execution_count" in cell.keys():
-                        cell["execution_count"] = (
-                            execution_count if execution_count > 0 else "null"
-                        )
-
-                    if remove_outputs and "outputs" in cell.keys():
-                        cell["outputs"] = []
-
-                    if (
-                        format
-                        and is_source
-                        and not is_source_empty
-                        and is_code
-                        and not is_shell_command
-                    ):
-                        try:
-                            mode = black.Mode(is_ipynb=True, **black_config)  # type: ignore
-                            str_cell_content = black.format_cell(
-                                "".join(cell["source"]), mode=mode, fast=False
-                            )
-                            cell_content = [
-                                f"{c}\n" for c in str_cell_content.split("\n")
-                            ]
-                            cell_content[-1] = cell_content[-1][
-                                :-1
-                            ]  # remove last newline
-                            cell["source"] = cell_content
-                        except black.NothingChanged:
-                            pass
-
-                    if (
-                        reorder_imports
-                        and is_source
-                        and not is_source_empty
-                        and is_code
-                        and not is_shell_command
-                    ):
-                        to_remove = {
-                            import_obj_from_str(s).key
-                            for k, v in REMOVALS.items()
-                            if min_python_version >= k
-                            for s in v
-                        }
-                        replace_import: List[str] = []
-                        for k, v in REPLACES.items():
-                            if min_python_version >= k:
-                                replace_import.extend(
-                                    _validate_replace_import(replace_s)
-                                    for replace_s in v
-                                )
-                        to_replace = Replacements.make(replace_import)
-                        str_cell_content = fix_file_contents(
-                            "".join(cell["source"]),
-                            to_replace=to_replace,
-                            to_remove=to_remove,
-                        )[:-1]
-                        cell_content = [f"{c}\n" for c in str_cell_content.split("\n")]
-                        cell_content[-1] = cell_content[-1][:-1]
-                        cell["source"] = cell_content
-
-                    if clear_cell_metadata and is_code and is_metadata:
-                        cell["metadata"] = {}
-
-                    if len(preserve_cell_metadata) > 0 and is_metadata and is_code:
-                        cell["metadata"] = {
-                            k: v
-                            for k, v in cell["metadata"].items()
-                            if k in preserve_cell_metadata
-                        }
-
-            with open(file) as f:
-                original_data = json.load(f)
-                if data == original_data:
-                    continue
-
-            with open(file, "w") as f:
-                f.write(json.dumps(data, indent=indent_level) + "\n")
-            print(f"Reformatted {str(file)}")
-        except Exception as e:
-            print(f"Reformatting failed: {str(file)}")
-            if not ignore_fails:
-                raise e
+
+                outcome: "Future[PipelineOutcome]" = Future()
+                try:
+                    changed, contents = _clean_read(file, read, clean_contents, profile)
+                except Exception as e:
+                    outcome.set_exception(e)
+                else:
+                    if contents is None:
+                        outcome.set_result((changed, None))
+                    else:
+                        outcome = writer.submit(_write_back, file, contents, fsync)
+                pending.append((file, outcome))
+
+                while pending and (pending[0][1].done() or len(pending) > prefetch):
+                    report_oldest()
+            while pending:
+                report_oldest()
+        except BaseException:
+            for read in reads:
+                read.cancel()
+            raise
+    return results
+
+
+def _clean_read(
+    file: Path,
+    read: "Future[Tuple[bytes, float, float]]",
+    clean_contents: Callable[..., Tuple[bool, Optional[str]]],
+    profile: Optional[Profile],
+) -> Tuple[bool, Optional[str]]:
+    """Clean a lab file read ahead by _run_pipeline().
+
+    :param Path file: lab file
+    :param Future[Tuple[bytes, float, float]] read: contents of the lab file, read by _timed()
+    :param Callable[..., Tuple[bool, Optional[str]]] clean_contents: _clean_contents() with the options of run()
+    :param Optional[Profile] profile: timings of each phase are added to this
+    :return Tuple[bool, Optional[str]]: see _clean_contents()
+    """
+    with contextlib.nullcontext() if profile is None else profile.notebook(file):
+        original, wall, cpu = read.result()
+        if profile is not None:
+            profile.add("read", wall, cpu)
+        return clean_contents(original, profile=profile)
+
+
+def _timed(function: Callable[[], Any]) -> Tuple[Any, float, float]:
+    """Call a function on an I/O thread, timing it for the profile of the main thread.
+
+    :param Callable[[], Any] function: function to call
+    :return Tuple[Any, float, float]: result, wall seconds and CPU seconds of the thread
+    """
+    start, cpu_start = time.perf_counter(), time.thread_time()
+    result = function()
+    return result, time.perf_counter() - start, time.thread_time() - cpu_start
+
+
+def _write_back(file: Path, contents: str, fsync: str) -> PipelineOutcome:
+    """Write a cleaned lab file on the write thread of _run_pipeline().
+
+    :param Path file: lab file
+    :param str contents: new contents
+    :param str fsync: fsync policy, see run()
+    :return PipelineOutcome: the lab file changed, and the time taken to write it
+    """
+    _, wall, cpu = _timed(partial(_write_file, file, contents, fsync))
+    return True, (wall, cpu)
+
+
+def _pipeline_outcome(
+    outcome: "Future[PipelineOutcome]", profile: Optional[Profile]
+) -> bool:
+    """Wait for a lab file cleaned by _run_pipeline() to be written.
+
+    :param Future[PipelineOutcome] outcome: outcome of cleaning and writing the lab file
+    :param Optional[Profile] profile: the time taken to write the lab file is added to this
+    :return bool: whether the lab file was changed
+    """
+    changed, write_time = outcome.result()
+    if profile is not None and write_time is not None:
+        profile.add("write", *write_time)
+    return changed
+
+
+@lru_cache(maxsize=None)
+def _get_cell_cache(store: Optional[Path], max_store_size: int, pid: int) -> CellCache:
+    """Cache of formatted cells, shared by all lab files formatted in a process.
+
+    :param Optional[Path] store: persistent store of formatted cells
+    :param int max_store_size: size in bytes of the persistent store
+    :param int pid: process id, so that forked processes don't share a connection to the store
+    :return CellCache: cache of formatted cells
+    """
+    return CellCache(store=store, max_store_size=max_store_size)
+
+
+def _format_cell(
+    source: str,
+    mode: "black.Mode",
+    mode_key: str,
+    cell_cache: CellCache,
+    fast: bool = False,
+    profile: Optional[Profile] = None,
+) -> str:
+    """Format a cell with black, reusing cached results.
+
+    Cells formatted without black's safety checks are cached separately, so that
+    they aren't reused when the checks are required.
+
+    :param str source: cell source
+    :param black.Mode mode: black configuration
+    :param str mode_key: cache key of the black version and configuration
+    :param CellCache cell_cache: cache of formatted cells
+    :param bool fast: skip black's safety checks, defaults to False
+    :param Optional[Profile] profile: whether the cached result was reused is added to this, defaults to None
+    :return str: formatted cell source
+    """
+    keys = [cell_cache.key(source, mode_key)]
+    if fast:
+        keys.append(cell_cache.key(source, f"{mode_key}:fast"))
+    for key in keys:
+        formatted = cell_cache.get(key)
+        if formatted is not None:
+            if profile is not None:
+                profile.add_lookup("format", True)
+            return formatted
+    if profile is not None:
+        profile.add_lookup("format", False)
+
+    import black
+
+    try:
+        formatted = black.format_cell(source, mode=mode, fast=fast)
+    except black.NothingChanged:
+        formatted = source
+    cell_cache.put(keys[-1], formatted)
+    return formatted
+
+
+@lru_cache(maxsize=None)
+def _reorder_imports_tables(
+    min_python_version: Tuple[int, ...]
+) -> Tuple[Set[Tuple[str, ...]], "Replacements"]:
+    """Imports to remove and replace with reorder-python-imports, which only depend on the minimum Python version of the lab file.
+
+    :param Tuple[int, ...] min_python_version: minimum Python version of the lab file
+    :return Tuple[Set[Tuple[str, ...]], Replacements]: imports to remove and imports to replace
+    """
+    from reorder_python_imports import _validate_replace_import
+    from reorder_python_imports import import_obj_from_str
+    from reorder_python_imports import REMOVALS
+    from reorder_python_imports import Replacements
+    from reorder_python_imports import REPLACES
+
+    to_remove = {
+        import_obj_from_str(s).key
+        for k, v in REMOVALS.items()
+        if min_python_version >= k
+        for s in v
+    }
+    replace_import: List[str] = []
+    for k, v in REPLACES.items():
+        if min_python_version >= k:
+            replace_import.extend(
+                _validate_replace_import(replace_s) for replace_s in v
+            )
+    return to_remove, Replacements.make(replace_import)
+
+
+@lru_cache(maxsize=None)
+def _reorder_imports_key(min_python_version: Tuple[int, ...]) -> str:
+    """Cache key of reorder-python-imports for the minimum Python version of a lab file.
+
+    :param Tuple[int, ...] min_python_version: minimum Python version of the lab file
+    :return str: cache key
+    """
+    version = get_tool_versions()["reorder-python-imports"]
+    return f"reorder-python-imports:{version}:{min_python_version}"
+
+
+def _reorder_cell(
+    source: str,
+    min_python_version: Tuple[int, ...],
+    cell_cache: CellCache,
+    profile: Optional[Profile] = None,
+) -> str:
+    """Reorder the imports of a cell with reorder-python-imports, reusing cached results.
+
+    :param str source: cell source
+    :param Tuple[int, ...] min_python_version: minimum Python version of the lab file
+    :param CellCache cell_cache: cache of cells
+    :param Optional[Profile] profile: whether the cached result was reused is added to this, defaults to None
+    :return str: cell source with reordered imports
+    """
+    key = cell_cache.key(source, _reorder_imports_key(min_python_version))
+    reordered = cell_cache.get(key)
+    if profile is not None:
+        profile.add_lookup("reorder_imports", reordered is not None)
+    if reordered is not None:
+        return reordered
+
+    from reorder_python_imports import fix_file_contents
+
+    to_remove, to_replace = _reorder_imports_tables(min_python_version)
+    reordered = fix_file_contents(source, to_replace=to_replace, to_remove=to_remove)[
+        :-1
+    ]
+    cell_cache.put(key, reordered)
+    return reordered
+
+
+Transform = Callable[["CellContext"], bool]
+
+
+@dataclass
+class NotebookContext:
+    """State of a lab file shared by the transforms of all of its cells."""
+
+    options: Options
+    cell_cache: CellCache
+    min_python_version: Tuple[int, ...]
+    timings: Optional[Dict[str, float]] = None
+    mode: Optional["black.Mode"] = None
+    mode_key: str = ""
+    formatted_cells: int = 0
+    profile: Optional[Profile] = None
+
+
+class CellContext:
+    """A cell and what the transforms know about it.
+
+    The flags are computed once per cell. The source is only joined into a string
+    when a transform needs it, and transforms pass it on as a string. It is split
+    back into the lines of the lab file once, after the last transform.
+    """
+
+    def __init__(self, cell: Dict[str, Any], notebook: NotebookContext) -> None:
+        """
+        :param Dict[str, Any] cell: cell of the lab file
+        :param NotebookContext notebook: state of the lab file
+        """
+        self.cell = cell
+        self.notebook = notebook
+        self.options = notebook.options
+        self.is_code = cell["cell_type"] == "code"
+        self.is_source = "source" in cell.keys()
+        self.is_source_empty = len(cell["source"]) == 0
+        self.is_shell_command = (
+            self.is_code
+            and self.is_source
+            and not self.is_source_empty
+            and cell["source"][0].strip() == "!"
+        )
+        self.is_metadata = "metadata" in cell.keys()
+        self.is_python = (
+            self.is_code
+            and self.is_source
+            and not self.is_source_empty
+            and not self.is_shell_command
+        )
+        # set by a transform to remove the cell from the lab file
+        self.remove = False
+        self._source: Optional[str] = None
+        self._source_set = False
+
+    @property
+    def source(self) -> str:
+        """Source of the cell as a single string."""
+        if self._source is None:
+            self._source = "".join(self.cell["source"])
+        return self._source
+
+    def set_source(self, source: str) -> bool:
+        """Replace the source of the cell. `cell["source"]` is updated after the last transform.
+
+        :param str source: new source of the cell
+        :return bool: whether the source was modified
+        """
+        changed = source != self.source
+        self._source = source
+        self._source_set = True
+        return changed
+
+    def write_source(self) -> bool:
+        """Split the source set by the transforms into the lines of the cell.
+
+        :return bool: whether the lines of the cell were modified
+        """
+        if not self._source_set or self._source is None:
+            return False
+        lines = [f"{c}\n" for c in self._source.split("\n")]
+        lines[-1] = lines[-1][:-1]  # remove last newline
+        if lines == self.cell["source"]:
+            return False
+        self.cell["source"] = lines
+        return True
+
+
+@dataclass
+class _RegisteredTransform:
+    name: str
+    transform: Transform
+    enabled: Callable[[Options], bool]
+
+
+_TRANSFORMS: List[_RegisteredTransform] = []
+
+
+def register_transform(
+    name: str,
+    enabled: Callable[[Options], bool] = lambda options: True,
+    before: Optional[str] = None,
+) -> Callable[[Transform], Transform]:
+    """Register a cell transform, run on every cell in the same pass as the built-in transforms.
+
+    A transform takes the CellContext of a cell and returns whether it modified the
+    cell. Transforms are registered at import time, so that they are also
+    registered in the processes used by `jobs`.
+
+    :param str name: name of the transform, used in timings
+    :param Callable[[Options], bool] enabled: whether the transform runs with the options, checked once per lab file. Defaults to always
+    :param Optional[str] before: name of the transform to run before, defaults to running after all other transforms
+    :raises ValueError: when a transform with the same name is already registered, or `before` isn't registered
+    :return Callable[[Transform], Transform]: decorator that registers the transform
+    """
+
+    def decorator(transform: Transform) -> Transform:
+        names = [registered.name for registered in _TRANSFORMS]
+        if name in names:
+            raise ValueError(f"Transform {name} is already registered")
+        if before is not None and before not in names:
+            raise ValueError(f"Transform {before} isn't registered")
+        index = len(_TRANSFORMS) if before is None else names.index(before)
+        _TRANSFORMS.insert(index, _RegisteredTransform(name, transform, enabled))
+        return transform
+
+    return decorator
+
+
+@register_transform("remove_empty_cells", lambda options: options.remove_empty_cells)
+def _remove_empty_cell(context: CellContext) -> bool:
+    if context.is_source and context.is_source_empty:
+        context.remove = True
+        return True
+    return False
+
+
+@register_transform("execution_count", lambda options: options.execution_count >= 0)
+def _set_execution_count(context: CellContext) -> bool:
+    if "execution_count" not in context.cell.keys():
+        return False
+    execution_count = context.options.execution_count
+    new_execution_count = execution_count if execution_count > 0 else "null"
+    if context.cell["execution_count"] == new_execution_count:
+        return False
+    context.cell["execution_count"] = new_execution_count
+    return True
+
+
+@register_transform("remove_outputs", lambda options: options.remove_outputs)
+def _remove_outputs(context: CellContext) -> bool:
+    if "outputs" not in context.cell.keys() or context.cell["outputs"] == []:
+        return False
+    context.cell["outputs"] = []
+    return True
+
+
+@register_transform("format", lambda options: options.format)
+def _format(context: CellContext) -> bool:
+    if not context.is_python:
+        return False
+    notebook = context.notebook
+    options = context.options
+    if notebook.mode is None:
+        import black
+
+        notebook.mode = black.Mode(is_ipynb=True, **(options.black_config or {}))  # type: ignore
+        notebook.mode_key = f"{black.__version__}:{notebook.mode.get_cache_key()}"
+    source = context.source
+    # With `options.fast`, black's safety checks are only run on a sample of cells
+    verify = not options.fast or (
+        options.verify_every > 0
+        and notebook.formatted_cells % options.verify_every == 0
+    )
+    notebook.formatted_cells += 1
+    formatted = _format_cell(
+        source,
+        notebook.mode,
+        notebook.mode_key,
+        notebook.cell_cache,
+        fast=not verify,
+        profile=notebook.profile,
+    )
+    if (
+        not verify
+        and options.verify_length_change > 0
+        and abs(len(formatted) - len(source))
+        > options.verify_length_change * len(source)
+    ):
+        formatted = _format_cell(
+            source,
+            notebook.mode,
+            notebook.mode_key,
+            notebook.cell_cache,
+            profile=notebook.profile,
+        )
+    return formatted != source and context.set_source(formatted)
+
+
+@register_transform("reorder_imports", lambda options: options.reorder_imports)
+def _reorder_imports(context: CellContext) -> bool:
+    if not context.is_python:
+        return False
+    notebook = context.notebook
+    return context.set_source(
+        _reorder_cell(
+            context.source,
+            notebook.min_python_version,
+            notebook.cell_cache,
+            notebook.profile,
+        )
+    )
+
+
+@register_transform("clear_cell_metadata", lambda options: options.clear_cell_metadata)
+def _clear_cell_metadata(context: CellContext) -> bool:
+    if not (context.is_code and context.is_metadata and context.cell["metadata"]):
+        return False
+    context.cell["metadata"] = {}
+    return True
+
+
+@register_transform(
+    "preserve_cell_metadata", lambda options: len(options.preserve_cell_metadata) > 0
+)
+def _preserve_cell_metadata(context: CellContext) -> bool:
+    if not (context.is_metadata and context.is_code):
+        return False
+    metadata = {
+        k: v
+        for k, v in context.cell["metadata"].items()
+        if k in context.options.preserve_cell_metadata
+    }
+    if len(metadata) == len(context.cell["metadata"]):
+        return False
+    context.cell["metadata"] = metadata
+    return True
+
+
+def _clean_cells(
+    data: Dict[str, Any],
+    options: Options,
+    cell_cache: CellCache,
+    check: bool = False,
+    timings: Optional[Dict[str, float]] = None,
+    profile: Optional[Profile] = None,
+) -> bool:
+    """Clean the cells of a lab file in place, running the enabled transforms on each cell in a single pass.
+
+    Transforms record whether they modified the lab file, so that it doesn't need
+    to be compared against the original to detect changes.
+
+    :param Dict[str, Any] data: lab file
+    :param Options options: cleaning options
+    :param CellCache cell_cache: cache of formatted cells
+    :param bool check: stop at the first cell that is modified, defaults to False
+    :param Optional[Dict[str, float]] timings: seconds spent in each transform are added to this, defaults to None
+    :param Optional[Profile] profile: timings of each transform and cell are added to this, defaults to None
+    :return bool: whether the lab file was modified
+    """
+    python_version = data["metadata"]["language_info"]["version"]
+    min_python_version = tuple(map(int, re.findall(r"(\d+)", python_version)))
+    if len(min_python_version) > 2:
+        min_python_version = min_python_version[:2]
+    notebook = NotebookContext(
+        options, cell_cache, min_python_version, timings, profile=profile
+    )
+    transforms = [
+        (registered.name, registered.transform)
+        for registered in _TRANSFORMS
+        if registered.enabled(options)
+    ]
+    if timings is not None:
+        for name, _ in transforms:
+            timings.setdefault(name, 0.0)
+
+    changed = False
+    # Removed cells are left out of a new list of cells, rather than removed from
+    # the list being iterated over.
+    cells = []
+    for index, cell in enumerate(data["cells"]):
+        if check and changed:
+            cells.extend(data["cells"][index:])
+            break
+
+        cell_start = time.perf_counter()
+        context = CellContext(cell, notebook)
+        for name, transform in transforms:
+            if timings is None and profile is None:
+                changed = transform(context) or changed
             else:
-                continue
+                start, cpu_start = time.perf_counter(), time.process_time()
+                changed = transform(context) or changed
+                wall = time.perf_counter() - start
+                if timings is not None:
+                    timings[name] += wall
+                if profile is not None:
+                    profile.add(name, wall, time.process_time() - cpu_start)
+            if context.remove:
+                break
+        else:
+            changed = context.write_source() or changed
+            cells.append(cell)
+        if profile is not None:
+            profile.add_cell(index, time.perf_counter() - cell_start)
+    data["cells"] = cells
+
+    return changed
 
 
 @lru_cache
@@ -245,6 +1256,24 @@ def parse_pyproject(
     Union[bool, None],
     Union[List[str], str, None],
     Union[bool, None],
+    Union[int, None],
+    Union[bool, None],
+    Union[int, None],
+    Union[bool, None],
+    Union[int, None],
+    Union[float, None],
+    Union[str, None],
+    Union[bool, None],
+    Union[str, None],
+    Union[bool, None],
+    Union[List[str], None],
+    Union[bool, None],
+    Union[bool, None],
+    Union[str, None],
+    Union[str, None],
+    Union[bool, None],
+    Union[int, None],
+    Union[int, None],
 ]:
     """Parse inputs from pyproject.toml
 
@@ -265,6 +1294,24 @@ def parse_pyproject(
             None,
             None,
             None,
+            None,
+            None,
+            None,
+            None,
+            None,
+            None,
+            None,
+            None,
+            None,
+            None,
+            None,
+            None,
+            None,
+            None,
+            None,
+            None,
+            None,
+            None,
         )
 
     with open(pyproject_path, "rb") as f:
@@ -295,6 +1342,28 @@ def parse_pyproject(
         config["preserve_cell_metadata"] if "preserve_cell_metadata" in config else None
     )
     ignore_fails = config["ignore_fails"] if "ignore_fails" in config else None
+    jobs = config["jobs"] if "jobs" in config else None
+    cache = config["cache"] if "cache" in config else None
+    cache_max_size = config["cache_max_size"] if "cache_max_size" in config else None
+    fast = config["fast"] if "fast" in config else None
+    verify_every = config["verify_every"] if "verify_every" in config else None
+    verify_length_change = (
+        config["verify_length_change"] if "verify_length_change" in config else None
+    )
+    changed_since = config["changed_since"] if "changed_since" in config else None
+    staged = config["staged"] if "staged" in config else None
+    fsync = config["fsync"] if "fsync" in config else None
+    check = config["check"] if "check" in config else None
+    prune_dirs = config["prune_dirs"] if "prune_dirs" in config else None
+    ignore_gitignore = (
+        config["ignore_gitignore"] if "ignore_gitignore" in config else None
+    )
+    profile = config["profile"] if "profile" in config else None
+    profile_output = config["profile_output"] if "profile_output" in config else None
+    json_backend = config["json_backend"] if "json_backend" in config else None
+    verbose = config["verbose"] if "verbose" in config else None
+    prefetch = config["prefetch"] if "prefetch" in config else None
+    max_memory = config["max_memory"] if "max_memory" in config else None
     return (
         files_or_dirs,
         execution_count,
@@ -307,25 +1376,61 @@ def parse_pyproject(
         clear_cell_metadata,
         preserve_cell_metadata,
         ignore_fails,
+        jobs,
+        cache,
+        cache_max_size,
+        fast,
+        verify_every,
+        verify_length_change,
+        changed_since,
+        staged,
+        fsync,
+        check,
+        prune_dirs,
+        ignore_gitignore,
+        profile,
+        profile_output,
+        json_backend,
+        verbose,
+        prefetch,
+        max_memory,
     )
 
 
-def parse_args() -> (
-    Tuple[
-        List[str],
-        int,
-        bool,
-        bool,
-        bool,
-        int,
-        Union[None, List[str]],
-        bool,
-        bool,
-        bool,
-        Union[None, List[str]],
-        bool,
-    ]
-):
+def parse_args(
+    argv: Optional[List[str]] = None,
+) -> Tuple[
+    List[str],
+    int,
+    bool,
+    bool,
+    bool,
+    int,
+    Union[None, List[str]],
+    bool,
+    bool,
+    bool,
+    Union[None, List[str]],
+    bool,
+    int,
+    bool,
+    int,
+    bool,
+    int,
+    float,
+    Union[str, None],
+    bool,
+    str,
+    bool,
+    List[str],
+    bool,
+    bool,
+    Union[str, None],
+    str,
+    bool,
+    int,
+    int,
+]:
     parser = argparse.ArgumentParser(description="jupyter_cleaner")
     parser.add_argument(
         "files_or_dirs",
@@ -392,7 +1497,109 @@ def parse_args() -> (
         action="store_true",
         help="Continue execution despite failures. Defaults to false.",
     )
-    args = parser.parse_args()
+    parser.add_argument(
+        "--jobs",
+        type=int,
+        default=1,
+        help="Number of lab files to format in parallel processes. 0 or a negative integer uses all available CPUs. Defaults to 1.",
+    )
+    parser.add_argument(
+        "--cache",
+        action="store_true",
+        help="Skip lab files that are unchanged since they were last formatted with the same options. Defaults to false.",
+    )
+    parser.add_argument(
+        "--cache_max_size",
+        type=int,
+        default=100,
+        help="Maximum size of the persistent cache of formatted cells in megabytes. Defaults to 100.",
+    )
+    parser.add_argument(
+        "--fast",
+        action="store_true",
+        help="Skip the check that formatted code is equivalent to the original code (uses black --fast). Defaults to false.",
+    )
+    parser.add_argument(
+        "--verify_every",
+        type=int,
+        default=0,
+        help="With --fast, check every nth formatted cell of a lab file. 0 doesn't check any cells. Defaults to 0.",
+    )
+    parser.add_argument(
+        "--verify_length_change",
+        type=float,
+        default=0,
+        help="With --fast, check cells whose length changed by more than this fraction. 0 doesn't check any cells. Defaults to 0.",
+    )
+    parser.add_argument(
+        "--changed_since",
+        type=str,
+        help="Only format lab files that changed in git since this reference, e.g. origin/main.",
+    )
+    parser.add_argument(
+        "--staged",
+        action="store_true",
+        help="Only format lab files that are staged in git. Defaults to false.",
+    )
+    parser.add_argument(
+        "--fsync",
+        type=str,
+        default="none",
+        choices=FSYNC_POLICIES,
+        help="When to flush rewritten files to disk: none leaves it to the operating system, always flushes every file and its directory, and batch flushes every file and each directory once at the end. Defaults to none.",
+    )
+    parser.add_argument(
+        "--check",
+        action="store_true",
+        help="Don't write the lab files back, only return a non-zero exit code if any lab file would be reformatted. Defaults to false.",
+    )
+    parser.add_argument(
+        "--prune_dirs",
+        type=str,
+        nargs="+",
+        default=list(PRUNE_DIRS),
+        help=f"Names of directories that aren't searched for lab files. Defaults to {' '.join(PRUNE_DIRS)}.",
+    )
+    parser.add_argument(
+        "--ignore_gitignore",
+        action="store_true",
+        help="Search lab files and directories that are ignored by .gitignore files. Defaults to false.",
+    )
+    parser.add_argument(
+        "--profile",
+        action="store_true",
+        help="Print the wall and CPU time taken by each phase, and the slowest lab files and cells. Defaults to false.",
+    )
+    parser.add_argument(
+        "--profile_output",
+        type=str,
+        help="With --profile, also write a JSON report of all timings to this file.",
+    )
+    parser.add_argument(
+        "--json_backend",
+        type=str,
+        default="auto",
+        choices=JSON_BACKENDS,
+        help="Library used to parse and serialise lab files. auto uses orjson if it is installed, otherwise json. The written lab files are identical with either library. Defaults to auto.",
+    )
+    parser.add_argument(
+        "--verbose",
+        action="store_true",
+        help="Print how many cells each transform reused from cells with the same source. Defaults to false.",
+    )
+    parser.add_argument(
+        "--prefetch",
+        type=int,
+        default=0,
+        help="With one job, number of lab files to read ahead, and to write behind, on I/O threads while lab files are cleaned. Hides the latency of slow or network storage. 0 reads, cleans and writes each lab file in turn. Defaults to 0.",
+    )
+    parser.add_argument(
+        "--max_memory",
+        type=int,
+        default=0,
+        help="With more than one job, memory budget in megabytes for the lab files cleaned at the same time, estimated from their sizes and, when outputs are removed, the number of quotes in them. Lab files are cleaned largest first, and a lab file larger than the budget is cleaned on its own. 0 doesn't limit memory. Defaults to 0.",
+    )
+    args = parser.parse_args(argv)
     return (
         args.files_or_dirs,
         args.execution_count,
@@ -406,19 +1613,272 @@ def parse_args() -> (
         args.clear_cell_metadata,
         args.preserve_cell_metadata,
         args.ignore_fails,
+        args.jobs,
+        args.cache,
+        args.cache_max_size,
+        args.fast,
+        args.verify_every,
+        args.verify_length_change,
+        args.changed_since,
+        args.staged,
+        args.fsync,
+        args.check,
+        args.prune_dirs,
+        args.ignore_gitignore,
+        args.profile,
+        args.profile_output,
+        args.json_backend,
+        args.verbose,
+        args.prefetch,
+        args.max_memory,
     )
 
 
-def get_lab_files(files_or_dirs: List[Path]) -> List[Path]:
-    files = []
+def get_lab_files(
+    files_or_dirs: List[Path],
+    exclude_files_or_dirs: Sequence[Path] = (),
+    prune_dirs: Sequence[str] = PRUNE_DIRS,
+    gitignore: bool = True,
+) -> List[Path]:
+    """Find lab files, searching directories recursively.
+
+    Excluded directories, directories named in `prune_dirs` and directories
+    ignored by .gitignore files are skipped without being searched. Lab files
+    passed in `files_or_dirs` are never ignored, as with black.
+
+    :param List[Path] files_or_dirs: lab files, or directories to search for lab files
+    :param Sequence[Path] exclude_files_or_dirs: lab files or directories to exclude, defaults to ()
+    :param Sequence[str] prune_dirs: names of directories that aren't searched, defaults to PRUNE_DIRS
+    :param bool gitignore: skip lab files and directories ignored by .gitignore files in the searched directories and their parents up to the project root, defaults to True
+    :raises ValueError: when a file or directory doesn't exist, or a .gitignore file is invalid
+    :return List[Path]: lab files
+    """
+    exclude = {os.path.abspath(file_or_dir) for file_or_dir in exclude_files_or_dirs}
+    exclude_paths = {Path(file_or_dir) for file_or_dir in exclude}
+    prune = set(prune_dirs)
+    files: List[Path] = []
     for file_or_dir in files_or_dirs:
+        # lab files passed explicitly, e.g. by pre-commit, can be in excluded directories
+        if _is_excluded(Path(os.path.abspath(file_or_dir)), exclude_paths):
+            continue
         if file_or_dir.is_dir():
-            files.extend([p for p in file_or_dir.rglob("*.ipynb")])
+            directory = str(file_or_dir)
+            gitignores = _parent_gitignores(directory) if gitignore else None
+            files.extend(
+                Path(file) for file in _walk(directory, exclude, prune, gitignores)
+            )
         elif file_or_dir.is_file() and file_or_dir.suffix == ".ipynb":
             files.append(file_or_dir)
         else:
             raise ValueError("File or directory does not exist or could not be found")
-    return list(set(files))
+    return sorted(set(files))
+
+
+# absolute path of a directory and the patterns of its .gitignore file
+GitIgnore = Tuple[str, "GitIgnoreSpec"]
+
+
+def _walk(
+    directory: str,
+    exclude: Set[str],
+    prune: Set[str],
+    gitignores: Optional[List[GitIgnore]] = None,
+) -> List[str]:
+    """Find lab files in a directory with os.scandir(), pruning directories before they are searched.
+
+    :param str directory: directory to search
+    :param Set[str] exclude: absolute paths of excluded lab files and directories
+    :param Set[str] prune: names of directories that aren't searched
+    :param Optional[List[GitIgnore]] gitignores: .gitignore files of the parents of the directory, or None to not read .gitignore files
+    :return List[str]: lab files
+    """
+    files = []
+    # (path, absolute path, .gitignore files that apply) of directories left to search
+    stack = [(directory, os.path.abspath(directory), gitignores)]
+    while stack:
+        path, abs_path, gitignores = stack.pop()
+        try:
+            with os.scandir(path) as it:
+                entries = list(it)
+        except OSError:
+            continue
+        if gitignores is not None and any(
+            entry.name == ".gitignore" for entry in entries
+        ):
+            spec = _read_gitignore(abs_path)
+            if spec is not None:
+                gitignores = [*gitignores, (abs_path, spec)]
+
+        for entry in entries:
+            abs_entry = os.path.join(abs_path, entry.name)
+            if abs_entry in exclude:
+                continue
+            # symlinks to directories aren't followed, as with Path.rglob()
+            is_dir = entry.is_dir(follow_symlinks=False)
+            if is_dir and entry.name in prune:
+                continue
+            if not is_dir and not (entry.name.endswith(".ipynb") and entry.is_file()):
+                continue
+            if gitignores and _is_ignored(abs_entry, is_dir, gitignores):
+                continue
+            if is_dir:
+                stack.append((entry.path, abs_entry, gitignores))
+            else:
+                files.append(entry.path)
+    return files
+
+
+def _read_gitignore(directory: str) -> Optional["GitIgnoreSpec"]:
+    """Read the .gitignore file of a directory.
+
+    :param str directory: directory
+    :raises ValueError: when the .gitignore file contains an invalid pattern
+    :return Optional[GitIgnoreSpec]: patterns of the .gitignore file, or None if it can't be read
+    """
+    gitignore = os.path.join(directory, ".gitignore")
+    try:
+        with open(gitignore, encoding="utf-8") as f:
+            lines = f.read().splitlines()
+    except (OSError, UnicodeDecodeError):
+        return None
+
+    from pathspec import GitIgnoreSpec
+
+    try:
+        return GitIgnoreSpec.from_lines(lines)
+    except ValueError as e:
+        raise ValueError(f"Could not parse {gitignore}: {e}") from None
+
+
+def _parent_gitignores(directory: str) -> List[GitIgnore]:
+    """.gitignore files of the parents of a directory, up to the project root.
+
+    :param str directory: directory
+    :return List[GitIgnore]: .gitignore files, from the project root down
+    """
+    root = find_project_root((directory,))
+    gitignores: List[GitIgnore] = []
+    parent = os.path.abspath(directory)
+    while Path(parent).resolve() != root:
+        grandparent = os.path.dirname(parent)
+        if grandparent == parent:
+            break
+        parent = grandparent
+        spec = _read_gitignore(parent)
+        if spec is not None:
+            gitignores.insert(0, (parent, spec))
+    return gitignores
+
+
+def _is_ignored(abs_path: str, is_dir: bool, gitignores: List[GitIgnore]) -> bool:
+    """Check if a path is ignored by any of the .gitignore files that apply to it.
+
+    :param str abs_path: absolute path
+    :param bool is_dir: whether the path is a directory
+    :param List[GitIgnore] gitignores: .gitignore files of the parents of the path
+    :return bool: whether the path is ignored
+    """
+    for directory, spec in gitignores:
+        relative = abs_path[len(directory) + 1 :]
+        if os.sep != "/":
+            relative = relative.replace(os.sep, "/")
+        if spec.match_file(f"{relative}/" if is_dir else relative):
+            return True
+    return False
+
+
+def _is_excluded(file: Path, exclude: Set[Path]) -> bool:
+    """Check if a lab file or one of its parent directories is excluded.
+
+    :param Path file: resolved path of a lab file
+    :param Set[Path] exclude: resolved paths of excluded lab files and directories
+    :return bool: whether the lab file is excluded
+    """
+    return file in exclude or any(parent in exclude for parent in file.parents)
+
+
+def get_changed_lab_files(
+    files_or_dirs: List[Path], changed_since: Optional[str], staged: bool
+) -> List[Path]:
+    """Get the lab files changed in the git repository of the current directory.
+
+    Only the changed files are listed, so directories don't need to be searched.
+
+    :param List[Path] files_or_dirs: lab files or directories that changed files must be in
+    :param Optional[str] changed_since: git reference to compare the working tree (or the staging area with `staged`) against
+    :param bool staged: only get lab files that are staged
+    :raises ValueError: when git fails, for example outside of a git repository
+    :return List[Path]: resolved paths of changed lab files
+    """
+    # --no-relative keeps names relative to the root with diff.relative set
+    args = ["diff", "--name-only", "--no-relative", "-z", "--diff-filter=d"]
+    if staged:
+        args.append("--cached")
+    if changed_since is not None:
+        args.append(changed_since)
+    root = Path(_git(["rev-parse", "--show-toplevel"]).strip())
+    # names are relative to the root of the repository, so lab files are matched from
+    # the root too rather than only in the current directory
+    changed_files = [
+        root / name for name in _git(args + ["--", ":(top)*.ipynb"]).split("\0") if name
+    ]
+
+    paths = [file_or_dir.resolve() for file_or_dir in files_or_dirs]
+    return sorted(
+        file
+        for file in changed_files
+        if any(file == path or path in file.parents for path in paths)
+    )
+
+
+def _git(args: List[str]) -> str:
+    """Run git in the current directory.
+
+    :param List[str] args: git arguments
+    :raises ValueError: when git fails
+    :return str: standard output
+    """
+    try:
+        return subprocess.run(
+            ["git", *args], capture_output=True, check=True, text=True
+        ).stdout
+    except (OSError, subprocess.CalledProcessError) as e:
+        stderr = getattr(e, "stderr", None) or str(e)
+        raise ValueError(f"git {' '.join(args)} failed: {stderr.strip()}") from e
+
+
+# options of main() after combining argparse and pyproject, returned by process_inputs()
+Inputs = Tuple[
+    List[Path],
+    int,
+    bool,
+    bool,
+    bool,
+    int,
+    List[Path],
+    bool,
+    bool,
+    List[str],
+    bool,
+    int,
+    bool,
+    int,
+    bool,
+    int,
+    float,
+    Union[str, None],
+    bool,
+    str,
+    bool,
+    List[str],
+    bool,
+    bool,
+    Union[str, None],
+    str,
+    bool,
+    int,
+    int,
+]
 
 
 def process_inputs(
@@ -433,6 +1893,24 @@ def process_inputs(
     args_clear_cell_metadata: bool,
     args_preserve_cell_metadata: Union[List[str], None],
     args_ignore_fails: bool,
+    args_jobs: int,
+    args_cache: bool,
+    args_cache_max_size: int,
+    args_fast: bool,
+    args_verify_every: int,
+    args_verify_length_change: float,
+    args_changed_since: Union[str, None],
+    args_staged: bool,
+    args_fsync: str,
+    args_check: bool,
+    args_prune_dirs: List[str],
+    args_ignore_gitignore: bool,
+    args_profile: bool,
+    args_profile_output: Union[str, None],
+    args_json_backend: str,
+    args_verbose: bool,
+    args_prefetch: int,
+    args_max_memory: int,
     project_files_or_dirs: Union[List[str], str, None],
     project_execution_count: Union[int, None],
     project_remove_outputs: Union[bool, None],
@@ -444,9 +1922,25 @@ def process_inputs(
     project_clear_cell_metadata: Union[bool, None],
     project_preserve_cell_metadata: Union[List[str], str, None],
     project_ignore_fails: Union[bool, None],
-) -> Tuple[
-    List[Path], int, bool, bool, bool, int, List[Path], bool, bool, List[str], bool
-]:
+    project_jobs: Union[int, None],
+    project_cache: Union[bool, None],
+    project_cache_max_size: Union[int, None],
+    project_fast: Union[bool, None],
+    project_verify_every: Union[int, None],
+    project_verify_length_change: Union[float, None],
+    project_changed_since: Union[str, None],
+    project_staged: Union[bool, None],
+    project_fsync: Union[str, None],
+    project_check: Union[bool, None],
+    project_prune_dirs: Union[List[str], None],
+    project_ignore_gitignore: Union[bool, None],
+    project_profile: Union[bool, None],
+    project_profile_output: Union[str, None],
+    project_json_backend: Union[str, None],
+    project_verbose: Union[bool, None],
+    project_prefetch: Union[int, None],
+    project_max_memory: Union[int, None],
+) -> Inputs:
     """Creates inputs of the right format and prioritises pyproject inputs over argparse inputs, outside of files and directories where all inputs are combined.
 
     :param List[str] args_files_or_dirs: files or directories from argparse
@@ -463,6 +1957,42 @@ def process_inputs(
     :param Union[bool, None] project_remove_empty_cells: remove empty cells from pyproject
     :param Union[bool, None] project_format: apply formatting from pyproject
     :param Union[bool, None] project_reorder_imports: reorder imports from pyproject
+    :param int args_jobs: number of parallel processes from argparse
+    :param Union[int, None] project_jobs: number of parallel processes from pyproject
+    :param bool args_cache: cache from argparse
+    :param Union[bool, None] project_cache: cache from pyproject
+    :param int args_cache_max_size: cache_max_size from argparse
+    :param Union[int, None] project_cache_max_size: cache_max_size from pyproject
+    :param bool args_fast: fast from argparse
+    :param Union[bool, None] project_fast: fast from pyproject
+    :param int args_verify_every: verify_every from argparse
+    :param Union[int, None] project_verify_every: verify_every from pyproject
+    :param float args_verify_length_change: verify_length_change from argparse
+    :param Union[float, None] project_verify_length_change: verify_length_change from pyproject
+    :param Union[str, None] args_changed_since: changed_since from argparse
+    :param Union[str, None] project_changed_since: changed_since from pyproject
+    :param bool args_staged: staged from argparse
+    :param Union[bool, None] project_staged: staged from pyproject
+    :param str args_fsync: fsync from argparse
+    :param Union[str, None] project_fsync: fsync from pyproject
+    :param bool args_check: check from argparse
+    :param Union[bool, None] project_check: check from pyproject
+    :param List[str] args_prune_dirs: prune_dirs from argparse
+    :param Union[List[str], None] project_prune_dirs: prune_dirs from pyproject
+    :param bool args_ignore_gitignore: ignore_gitignore from argparse
+    :param Union[bool, None] project_ignore_gitignore: ignore_gitignore from pyproject
+    :param bool args_profile: profile from argparse
+    :param Union[bool, None] project_profile: profile from pyproject
+    :param Union[str, None] args_profile_output: profile_output from argparse
+    :param Union[str, None] project_profile_output: profile_output from pyproject
+    :param str args_json_backend: json_backend from argparse
+    :param Union[str, None] project_json_backend: json_backend from pyproject
+    :param bool args_verbose: verbose from argparse
+    :param Union[bool, None] project_verbose: verbose from pyproject
+    :param int args_prefetch: prefetch from argparse
+    :param Union[int, None] project_prefetch: prefetch from pyproject
+    :param int args_max_memory: max_memory from argparse
+    :param Union[int, None] project_max_memory: max_memory from pyproject
     :return Tuple[ Union[List[str], str, None], Union[int, None], Union[bool, None], Union[bool, None], Union[bool, None], ]: inputs to run()
     """
 
@@ -523,6 +2053,54 @@ def process_inputs(
     ignore_fails = (
         project_ignore_fails if project_ignore_fails is not None else args_ignore_fails
     )
+    jobs = project_jobs if project_jobs is not None else args_jobs
+    cache = project_cache if project_cache is not None else args_cache
+    cache_max_size = (
+        project_cache_max_size
+        if project_cache_max_size is not None
+        else args_cache_max_size
+    )
+    fast = project_fast if project_fast is not None else args_fast
+    verify_every = (
+        project_verify_every if project_verify_every is not None else args_verify_every
+    )
+    verify_length_change = (
+        project_verify_length_change
+        if project_verify_length_change is not None
+        else args_verify_length_change
+    )
+    changed_since = (
+        project_changed_since
+        if project_changed_since is not None
+        else args_changed_since
+    )
+    staged = project_staged if project_staged is not None else args_staged
+    fsync = project_fsync if project_fsync is not None else args_fsync
+    check = project_check if project_check is not None else args_check
+    if isinstance(project_prune_dirs, str):
+        project_prune_dirs = [project_prune_dirs]
+    prune_dirs = (
+        project_prune_dirs if project_prune_dirs is not None else args_prune_dirs
+    )
+    ignore_gitignore = (
+        project_ignore_gitignore
+        if project_ignore_gitignore is not None
+        else args_ignore_gitignore
+    )
+    profile = project_profile if project_profile is not None else args_profile
+    profile_output = (
+        project_profile_output
+        if project_profile_output is not None
+        else args_profile_output
+    )
+    json_backend = (
+        project_json_backend if project_json_backend is not None else args_json_backend
+    )
+    verbose = project_verbose if project_verbose is not None else args_verbose
+    prefetch = project_prefetch if project_prefetch is not None else args_prefetch
+    max_memory = (
+        project_max_memory if project_max_memory is not None else args_max_memory
+    )
 
     return (
         files_or_dirs,
@@ -536,10 +2114,67 @@ def process_inputs(
         clear_cell_metadata,
         preserve_cell_metadata,
         ignore_fails,
+        jobs,
+        cache,
+        cache_max_size,
+        fast,
+        verify_every,
+        verify_length_change,
+        changed_since,
+        staged,
+        fsync,
+        check,
+        prune_dirs,
+        ignore_gitignore,
+        profile,
+        profile_output,
+        json_backend,
+        verbose,
+        prefetch,
+        max_memory,
     )
 
 
-def main() -> None:
+def _select_lab_files(
+    files_or_dirs: List[Path],
+    exclude_files_or_dirs: List[Path],
+    changed_since: Optional[str],
+    staged: bool,
+    prune_dirs: List[str],
+    ignore_gitignore: bool,
+) -> List[Path]:
+    """Find the lab files to clean. Excluded lab files are left out while searching,
+    so aren't passed to run()
+
+    :param List[Path] files_or_dirs: lab files or directories to search
+    :param List[Path] exclude_files_or_dirs: lab files or directories to exclude
+    :param Optional[str] changed_since: only lab files changed since this git revision
+    :param bool staged: only lab files staged in git
+    :param List[str] prune_dirs: directory names to not descend into
+    :param bool ignore_gitignore: don't skip lab files ignored by .gitignore files
+    :return List[Path]: lab files
+    """
+    if changed_since is not None or staged:
+        exclude = {file_or_dir.resolve() for file_or_dir in exclude_files_or_dirs}
+        return [
+            file
+            for file in get_changed_lab_files(files_or_dirs, changed_since, staged)
+            if not _is_excluded(file, exclude)
+        ]
+    return get_lab_files(
+        files_or_dirs,
+        exclude_files_or_dirs,
+        prune_dirs,
+        gitignore=not ignore_gitignore,
+    )
+
+
+def get_inputs(argv: Optional[List[str]] = None) -> Inputs:
+    """Parse the command line arguments and combine them with the options in pyproject.toml
+
+    :param Optional[List[str]] argv: command line arguments, defaults to sys.argv
+    :return Inputs: inputs of main()
+    """
     (
         args_files_or_dirs,
         args_execution_count,
@@ -553,7 +2188,25 @@ def main() -> None:
         args_clear_cell_metadata,
         args_preserve_cell_metadata,
         args_ignore_fails,
-    ) = parse_args()
+        args_jobs,
+        args_cache,
+        args_cache_max_size,
+        args_fast,
+        args_verify_every,
+        args_verify_length_change,
+        args_changed_since,
+        args_staged,
+        args_fsync,
+        args_check,
+        args_prune_dirs,
+        args_ignore_gitignore,
+        args_profile,
+        args_profile_output,
+        args_json_backend,
+        args_verbose,
+        args_prefetch,
+        args_max_memory,
+    ) = parse_args(argv)
 
     (
         project_files_or_dirs,
@@ -567,21 +2220,27 @@ def main() -> None:
         project_clear_cell_metadata,
         project_preserve_cell_metadata,
         project_ignore_fails,
+        project_jobs,
+        project_cache,
+        project_cache_max_size,
+        project_fast,
+        project_verify_every,
+        project_verify_length_change,
+        project_changed_since,
+        project_staged,
+        project_fsync,
+        project_check,
+        project_prune_dirs,
+        project_ignore_gitignore,
+        project_profile,
+        project_profile_output,
+        project_json_backend,
+        project_verbose,
+        project_prefetch,
+        project_max_memory,
     ) = parse_pyproject(args_ignore_pyproject)
 
-    (
-        files_or_dirs,
-        execution_count,
-        remove_outputs,
-        format,
-        reorder_imports,
-        indent_level,
-        exclude_files_or_dirs,
-        remove_empty_cells,
-        clear_cell_metadata,
-        preserve_cell_metadata,
-        ignore_fails,
-    ) = process_inputs(
+    return process_inputs(
         args_files_or_dirs,
         args_execution_count,
         args_remove_outputs,
@@ -593,6 +2252,24 @@ def main() -> None:
         args_clear_cell_metadata,
         args_preserve_cell_metadata,
         args_ignore_fails,
+        args_jobs,
+        args_cache,
+        args_cache_max_size,
+        args_fast,
+        args_verify_every,
+        args_verify_length_change,
+        args_changed_since,
+        args_staged,
+        args_fsync,
+        args_check,
+        args_prune_dirs,
+        args_ignore_gitignore,
+        args_profile,
+        args_profile_output,
+        args_json_backend,
+        args_verbose,
+        args_prefetch,
+        args_max_memory,
         project_files_or_dirs,
         project_execution_count,
         project_remove_outputs,
@@ -604,21 +2281,94 @@ def main() -> None:
         project_clear_cell_metadata,
         project_preserve_cell_metadata,
         project_ignore_fails,
+        project_jobs,
+        project_cache,
+        project_cache_max_size,
+        project_fast,
+        project_verify_every,
+        project_verify_length_change,
+        project_changed_since,
+        project_staged,
+        project_fsync,
+        project_check,
+        project_prune_dirs,
+        project_ignore_gitignore,
+        project_profile,
+        project_profile_output,
+        project_json_backend,
+        project_verbose,
+        project_prefetch,
+        project_max_memory,
     )
 
-    files = get_lab_files(files_or_dirs)
-    exclude_files = get_lab_files(exclude_files_or_dirs)
 
-    run(
+def main() -> None:
+    (
+        files_or_dirs,
+        execution_count,
+        remove_outputs,
+        format,
+        reorder_imports,
+        indent_level,
+        exclude_files_or_dirs,
+        remove_empty_cells,
+        clear_cell_metadata,
+        preserve_cell_metadata,
+        ignore_fails,
+        jobs,
+        cache,
+        cache_max_size,
+        fast,
+        verify_every,
+        verify_length_change,
+        changed_since,
+        staged,
+        fsync,
+        check,
+        prune_dirs,
+        ignore_gitignore,
+        profile,
+        profile_output,
+        json_backend,
+        verbose,
+        prefetch,
+        max_memory,
+    ) = get_inputs()
+
+    files = _select_lab_files(
+        files_or_dirs,
+        exclude_files_or_dirs,
+        changed_since,
+        staged,
+        prune_dirs,
+        ignore_gitignore,
+    )
+    changed_files = run(
         files,
         execution_count,
         remove_outputs,
         format,
         reorder_imports,
         indent_level,
-        exclude_files,
+        [],
         remove_empty_cells,
         clear_cell_metadata,
         preserve_cell_metadata,
         ignore_fails,
+        jobs=jobs,
+        cache=cache,
+        cache_max_size=cache_max_size,
+        fast=fast,
+        verify_every=verify_every,
+        verify_length_change=verify_length_change,
+        fsync=fsync,
+        check=check,
+        profile=profile,
+        profile_output=None if profile_output is None else Path(profile_output),
+        json_backend=json_backend,
+        verbose=verbose,
+        prefetch=prefetch,
+        max_memory=max_memory,
     )
+    if check and changed_files:
+        sys.exit(1)
@@ -0,0 +1,196 @@
+"""Collection of per-phase timings of run(), reported with --profile.
+
+Phases are reading and parsing lab files, each cell transform, serialisation and
+writing. Wall and CPU time are recorded for each phase, and wall time for each lab
+file and cell, so that the slowest lab files and cells can be reported. The cells
+that transforms reused from earlier cells with the same source are counted too, and
+reported with --verbose.
+"""
+import contextlib
+import json
+import time
+from pathlib import Path
+from typing import Any
+from typing import ContextManager
+from typing import Dict
+from typing import Iterator
+from typing import List
+from typing import Optional
+from typing import Tuple
+
+
+class Profile:
+    """Timings of the lab files cleaned by a process."""
+
+    def __init__(self) -> None:
+        # phase: [wall seconds, CPU seconds, number of calls]
+        self.phases: Dict[str, List[float]] = {}
+        # (lab file, wall seconds, CPU seconds, number of cells)
+        self.notebooks: List[Tuple[str, float, float, int]] = []
+        # (lab file, index of the cell, wall seconds)
+        self.cells: List[Tuple[str, int, float]] = []
+        # transform: [cells reused from the cache, cells looked up in the cache]
+        self.dedup: Dict[str, List[int]] = {}
+        self.file = ""
+        self._cells = 0
+
+    def add(self, phase: str, wall: float, cpu: float) -> None:
+        """Record the time taken by a phase.
+
+        :param str phase: name of the phase
+        :param float wall: wall seconds
+        :param float cpu: CPU seconds
+        """
+        totals = self.phases.setdefault(phase, [0.0, 0.0, 0])
+        totals[0] += wall
+        totals[1] += cpu
+        totals[2] += 1
+
+    def add_cell(self, index: int, wall: float) -> None:
+        """Record the time taken to clean a cell of the current lab file.
+
+        :param int index: index of the cell in the lab file
+        :param float wall: wall seconds
+        """
+        self.cells.append((self.file, index, wall))
+        self._cells += 1
+
+    def add_lookup(self, transform: str, hit: bool) -> None:
+        """Record whether a transform reused the result of a cell with the same source.
+
+        :param str transform: name of the transform
+        :param bool hit: whether the result was reused
+        """
+        counts = self.dedup.setdefault(transform, [0, 0])
+        counts[0] += hit
+        counts[1] += 1
+
+    @contextlib.contextmanager
+    def phase(self, phase: str) -> Iterator[None]:
+        """Record the time taken by the body of the with statement as a phase.
+
+        :param str phase: name of the phase
+        """
+        start, cpu_start = time.perf_counter(), time.process_time()
+        try:
+            yield
+        finally:
+            self.add(
+                phase, time.perf_counter() - start, time.process_time() - cpu_start
+            )
+
+    @contextlib.contextmanager
+    def notebook(self, file: Path) -> Iterator[None]:
+        """Record the time taken by the body of the with statement for a lab file.
+
+        :param Path file: lab file
+        """
+        self.file = str(file)
+        self._cells = 0
+        start, cpu_start = time.perf_counter(), time.process_time()
+        try:
+            yield
+        finally:
+            self.notebooks.append(
+                (
+                    self.file,
+                    time.perf_counter() - start,
+                    time.process_time() - cpu_start,
+                    self._cells,
+                )
+            )
+
+    def merge(self, other: "Profile") -> None:
+        """Add the timings of another process.
+
+        :param Profile other: timings of the other process
+        """
+        for phase, (wall, cpu, calls) in other.phases.items():
+            totals = self.phases.setdefault(phase, [0.0, 0.0, 0])
+            totals[0] += wall
+            totals[1] += cpu
+            totals[2] += calls
+        self.notebooks.extend(other.notebooks)
+        self.cells.extend(other.cells)
+        for transform, (hits, lookups) in other.dedup.items():
+            counts = self.dedup.setdefault(transform, [0, 0])
+            counts[0] += hits
+            counts[1] += lookups
+
+    def summary(self, top: int = 10) -> str:
+        """Table of the time taken by each phase, and of the slowest lab files and cells.
+
+        :param int top: number of lab files and cells to list, defaults to 10
+        :return str: summary
+        """
+        lines = [f"{'Phase':<40} {'Wall (s)':>10} {'CPU (s)':>10} {'Calls':>8}"]
+        for phase, (wall, cpu, calls) in self.phases.items():
+            lines.append(f"{phase:<40} {wall:>10.3f} {cpu:>10.3f} {calls:>8}")
+
+        lines += [
+            "",
+            f"{'Slowest lab files':<40} {'Wall (s)':>10} {'CPU (s)':>10} {'Cells':>8}",
+        ]
+        for file, wall, cpu, cells in sorted(self.notebooks, key=lambda n: -n[1])[:top]:
+            lines.append(f"{file:<40} {wall:>10.3f} {cpu:>10.3f} {cells:>8}")
+
+        lines += ["", f"{'Slowest cells':<40} {'Wall (s)':>10}"]
+        for file, index, wall in sorted(self.cells, key=lambda c: -c[2])[:top]:
+            lines.append(f"{f'{file} (cell {index})':<40} {wall:>10.3f}")
+
+        if self.dedup:
+            lines += ["", self.dedup_summary()]
+        return "\n".join(lines)
+
+    def dedup_summary(self) -> str:
+        """Table of the cells that each transform reused from a cell with the same source.
+
+        :return str: summary
+        """
+        lines = [f"{'Deduplicated cells':<40} {'Reused':>10} {'Cells':>10} {'Rate':>8}"]
+        for transform, (hits, lookups) in self.dedup.items():
+            rate = hits / lookups if lookups else 0
+            lines.append(f"{transform:<40} {hits:>10} {lookups:>10} {rate:>8.1%}")
+        return "\n".join(lines)
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Machine-readable report of all timings.
+
+        :return Dict[str, Any]: report
+        """
+        return {
+            "phases": {
+                phase: {"wall": wall, "cpu": cpu, "calls": calls}
+                for phase, (wall, cpu, calls) in self.phases.items()
+            },
+            "notebooks": [
+                {"file": file, "wall": wall, "cpu": cpu, "cells": cells}
+                for file, wall, cpu, cells in self.notebooks
+            ],
+            "cells": [
+                {"file": file, "index": index, "wall": wall}
+                for file, index, wall in self.cells
+            ],
+            "dedup": {
+                transform: {"hits": hits, "lookups": lookups}
+                for transform, (hits, lookups) in self.dedup.items()
+            },
+        }
+
+    def write(self, file: Path) -> None:
+        """Write the report of all timings as JSON.
+
+        :param Path file: JSON file
+        """
+        with open(file, "w") as f:
+            json.dump(self.to_dict(), f, indent=2)
+
+
+def phase(profile: Optional[Profile], name: str) -> ContextManager[None]:
+    """Profile.phase(), or a context manager that does nothing without a profile.
+
+    :param Optional[Profile] profile: timings, or None when not profiling
+    :param str name: name of the phase
+    :return ContextManager[None]: context manager
+    """
+    return contextlib.nullcontext() if profile is None else profile.phase(name)
@@ -0,0 +1,125 @@
+"""Reading of lab files that skips cell outputs without parsing them.
+
+Outputs of cells (images, plots, HTML) are usually most of a lab file. When they are
+removed anyway, the reader finds the end of each "outputs" array by scanning the raw
+bytes and splices an empty array in its place, so that the outputs are never decoded
+into Python objects. The rest of the lab file is parsed once with the JSON backend.
+"""
+import re
+from typing import Any
+from typing import Dict
+from typing import List
+from typing import Tuple
+
+from jupyter_cleaner import json_backend
+
+_OUTPUTS_KEY = b'"outputs"'
+# the colon and opening bracket after an "outputs" key, and the whitespace in the array
+_OUTPUTS_ARRAY = re.compile(rb"[ \t\n\r]*:[ \t\n\r]*(\[)[ \t\n\r]*")
+_BACKSLASH = ord("\\")
+_STRUCTURE = re.compile(rb'["\[\]{}]')
+_CLOSING = {b"[": b"]", b"{": b"}"}
+# Strings in outputs are skipped one at a time in Python, so the reader is only faster
+# than parsing the whole lab file with the JSON backend when outputs are mostly long
+# strings, like images. The length of strings is estimated from the number of quotes.
+MIN_BYTES_PER_QUOTE = 400
+
+
+class _Unsupported(Exception):
+    """The lab file can't be read by the reader, and is parsed with json instead."""
+
+
+def loads(
+    buffer: bytes, skip_outputs: bool, backend: str = "auto"
+) -> Tuple[Dict[str, Any], bool]:
+    """Read a lab file.
+
+    :param bytes buffer: contents of a lab file
+    :param bool skip_outputs: replace the outputs of cells with an empty list without parsing them
+    :param str backend: JSON backend, see json_backend.loads(). Defaults to "auto"
+    :raises json.JSONDecodeError: when the lab file isn't valid JSON
+    :return Tuple[Dict[str, Any], bool]: lab file and whether any outputs were removed
+    """
+    if skip_outputs and len(buffer) >= MIN_BYTES_PER_QUOTE * buffer.count(b'"'):
+        try:
+            return _loads_without_outputs(buffer, backend)
+        except _Unsupported:
+            pass
+    return json_backend.loads(buffer, backend), False
+
+
+def _loads_without_outputs(buffer: bytes, backend: str) -> Tuple[Dict[str, Any], bool]:
+    parts: List[bytes] = []
+    outputs = 0
+    start = pos = 0
+    while True:
+        pos = buffer.find(_OUTPUTS_KEY, pos)
+        if pos == -1:
+            break
+        match = _OUTPUTS_ARRAY.match(buffer, pos + len(_OUTPUTS_KEY))
+        # the quote is escaped when "outputs" is within a string, and there is no
+        # colon when it is a value rather than a key
+        if _is_escaped(buffer, pos) or match is None:
+            pos += 1
+            continue
+        outputs += 1
+        pos = match.end()
+        if buffer[pos : pos + 1] != b"]":
+            end = _value_end(buffer, match.start(1))
+            parts.append(buffer[start : match.end(1)])
+            start = pos = end - 1
+    if not parts:
+        return json_backend.loads(buffer, backend), False
+
+    parts.append(buffer[start:])
+    try:
+        data = json_backend.loads(b"".join(parts), backend)
+    except ValueError:
+        raise _Unsupported from None
+    # "outputs" keys outside of cells, e.g. in metadata, aren't supported
+    cells = data.get("cells") if isinstance(data, dict) else None
+    if not isinstance(cells, list) or outputs != sum(
+        isinstance(cell, dict) and cell.get("outputs") == [] for cell in cells
+    ):
+        raise _Unsupported
+    return data, True
+
+
+def _is_escaped(buffer: bytes, pos: int) -> bool:
+    backslashes = 0
+    while pos > backslashes and buffer[pos - 1 - backslashes] == _BACKSLASH:
+        backslashes += 1
+    return backslashes % 2 == 1
+
+
+def _value_end(buffer: bytes, start: int) -> int:
+    """Find the end of the array or object starting at `start` without parsing it."""
+    closing: List[bytes] = []
+    pos = start
+    while True:
+        match = _STRUCTURE.search(buffer, pos)
+        if match is None:
+            raise _Unsupported
+        char = match.group()
+        if char == b'"':
+            pos = _string_end(buffer, match.start())
+            continue
+        pos = match.end()
+        if char in _CLOSING:
+            closing.append(_CLOSING[char])
+        elif not closing or closing.pop() != char:
+            raise _Unsupported
+        if not closing:
+            return pos
+
+
+def _string_end(buffer: bytes, start: int) -> int:
+    pos = start + 1
+    while True:
+        # find() is much faster than a regex on long strings like base64 images
+        end = buffer.find(b'"', pos)
+        if end == -1:
+            raise _Unsupported
+        if not _is_escaped(buffer, end):
+            return end + 1
+        pos = end + 1
@@ -1,12 +1,33 @@
 import json
 import os
+import subprocess
 import sys
 import tempfile
+import time
+from concurrent.futures import Future
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
+from typing import Dict
+from typing import List
 from unittest import mock
 
+import black
 import pytest
+from jupyter_cleaner.jupyter_cleaner import _estimate_memory
+from jupyter_cleaner.jupyter_cleaner import _format_cell
+from jupyter_cleaner.jupyter_cleaner import _get_cell_cache
+from jupyter_cleaner.jupyter_cleaner import _schedule
+from jupyter_cleaner.jupyter_cleaner import _TRANSFORMS
+from jupyter_cleaner.jupyter_cleaner import _write_file
+from jupyter_cleaner.jupyter_cleaner import CellContext
+from jupyter_cleaner.jupyter_cleaner import clean_notebook
+from jupyter_cleaner.jupyter_cleaner import get_lab_files
 from jupyter_cleaner.jupyter_cleaner import main
+from jupyter_cleaner.jupyter_cleaner import NOTEBOOK_MEMORY_FACTOR
+from jupyter_cleaner.jupyter_cleaner import NotebookContext
+from jupyter_cleaner.jupyter_cleaner import Options
+from jupyter_cleaner.jupyter_cleaner import register_transform
+from jupyter_cleaner.jupyter_cleaner import run
 
 
 def test_defaults() -> None:
@@ -2024,3 +2045,799 @@ def test_ignore_fails() -> None:
     ]
     with mock.patch.object(sys, "argv", input_args):
         main()
+
+
+@pytest.mark.parametrize("max_memory", ["0", "1"])
+def test_jobs(max_memory: str, capsys: pytest.CaptureFixture) -> None:
+    """Lab files are formatted in parallel and reported in a deterministic order"""
+    data = {
+        "cells": [
+            {
+                "cell_type": "code",
+                "execution_count": 5,
+                "metadata": {},
+                "outputs": [],
+                "source": ["a=1\na"],
+            },
+        ],
+        "metadata": {"language_info": {"version": "3.10.10"}},
+        "nbformat": 4,
+        "nbformat_minor": 2,
+    }
+    expected_result = {
+        "cells": [
+            {
+                "cell_type": "code",
+                "execution_count": 5,
+                "metadata": {},
+                "outputs": [],
+                "source": ["a = 1\n", "a"],
+            },
+        ],
+        "metadata": {"language_info": {"version": "3.10.10"}},
+        "nbformat": 4,
+        "nbformat_minor": 2,
+    }
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        files = [Path(tmp_dir, f"{i}.ipynb") for i in range(4)]
+        for file in files:
+            with open(file, "w") as f:
+                json.dump(data, f)
+        with open(files[2], "w") as f:
+            f.write(json.dumps(data)[:-1])
+        input_args = [
+            "jupyter-cleaner",
+            tmp_dir,
+            "--format",
+            "--ignore_pyproject",
+            "--ignore_fails",
+            "--jobs",
+            "2",
+            "--max_memory",
+            max_memory,
+        ]
+        with mock.patch.object(sys, "argv", input_args):
+            main()
+
+        assert capsys.readouterr().out.splitlines() == [
+            f"Reformatted {files[0]}",
+            f"Reformatted {files[1]}",
+            f"Reformatting failed: {files[2]}",
+            f"Reformatted {files[3]}",
+        ]
+        for i in (0, 1, 3):
+            with open(files[i]) as f:
+                assert json.load(f) == expected_result
+
+
+def test_jobs_stop_at_fail() -> None:
+    """A failure in a parallel process is raised when `ignore_fails` is off"""
+    data = {
+        "cells": [],
+        "metadata": {"language_info": {"version": "3.10.10"}},
+        "nbformat": 4,
+        "nbformat_minor": 2,
+    }
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        files = [Path(tmp_dir, f"{i}.ipynb") for i in range(3)]
+        for file in files:
+            with open(file, "w") as f:
+                json.dump(data, f)
+        with open(files[1], "w") as f:
+            f.write(json.dumps(data)[:-1])
+        with pytest.raises(json.decoder.JSONDecodeError):
+            run(files, jobs=2)
+
+
+@pytest.mark.parametrize("prefetch", [1, 3])
+def test_prefetch(prefetch: int, capsys: pytest.CaptureFixture) -> None:
+    """Lab files are read ahead and written behind, and reported in order"""
+    data = {
+        "cells": [
+            {
+                "cell_type": "code",
+                "execution_count": 5,
+                "metadata": {},
+                "outputs": [],
+                "source": ["a=1\na"],
+            },
+        ],
+        "metadata": {"language_info": {"version": "3.10.10"}},
+        "nbformat": 4,
+        "nbformat_minor": 2,
+    }
+    expected_result = json.loads(json.dumps(data))
+    expected_result["cells"][0]["source"] = ["a = 1\n", "a"]
+
+    def write_file(file: Path, contents: str, fsync: str) -> None:
+        if file.name == "4.ipynb":
+            raise OSError("disk full")
+        _write_file(file, contents, fsync)
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        files = [Path(tmp_dir, f"{i}.ipynb") for i in range(6)]
+        for file in files:
+            file.write_text(json.dumps(data))
+        files[2].write_text(json.dumps(data)[:-1])
+        files[3].write_text(json.dumps(expected_result, indent=4) + "\n")
+        with mock.patch(
+            "jupyter_cleaner.jupyter_cleaner._write_file", side_effect=write_file
+        ):
+            run(files, 5, ignore_fails=True, prefetch=prefetch)
+            assert capsys.readouterr().out.splitlines() == [
+                f"Reformatted {files[0]}",
+                f"Reformatted {files[1]}",
+                f"Reformatting failed: {files[2]}",
+                f"Reformatting failed: {files[4]}",
+                f"Reformatted {files[5]}",
+            ]
+            with pytest.raises(OSError, match="disk full"):
+                run(files[3:], 5, prefetch=prefetch)
+        for i in (0, 1, 3, 5):
+            assert json.loads(files[i].read_text()) == expected_result
+
+
+def test_schedule() -> None:
+    """Lab files are cleaned largest first within the memory budget"""
+    sizes = [1, 60, 5, 70, 30, 2]
+    submitted: List[int] = []
+    running: List[int] = []
+    peak = [0]
+
+    def clean(size: int) -> None:
+        running.append(size)
+        peak[0] = max(peak[0], sum(running) * NOTEBOOK_MEMORY_FACTOR)
+        time.sleep(0.01)
+        running.remove(size)
+
+    with tempfile.TemporaryDirectory() as tmp_dir, ThreadPoolExecutor(4) as executor:
+        files = [Path(tmp_dir, f"{i}.ipynb") for i in range(len(sizes))]
+        for file, size in zip(files, sizes):
+            file.write_bytes(b" " * size)
+
+        def submit(file: Path) -> "Future[None]":
+            size = file.stat().st_size
+            submitted.append(size)
+            return executor.submit(clean, size)
+
+        budget = 100 * NOTEBOOK_MEMORY_FACTOR
+        assert [file for file, _ in _schedule(files, submit, budget)] == files
+        assert submitted == sorted(sizes, reverse=True)
+        # 60 and 70 are over half of the budget, so never run together
+        assert peak[0] <= budget
+
+        submitted.clear()
+        assert [file for file, _ in _schedule(files, submit, 1)] == files
+        assert submitted == sorted(sizes, reverse=True)
+        # lab files larger than the budget run on their own
+        assert peak[0] <= budget
+
+
+def test_estimate_memory() -> None:
+    """Lab files whose outputs are removed are estimated from their number of quotes"""
+    outputs = [{"data": {"image/png": "iVBORw0KGgo" * 10000}, "output_type": "x"}]
+    cell = {"cell_type": "code", "outputs": outputs, "source": ["a = 1\n", "a"]}
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        large_outputs = Path(tmp_dir, "large_outputs.ipynb")
+        large_outputs.write_text(json.dumps({"cells": [cell] * 10}))
+        size = large_outputs.stat().st_size
+        assert _estimate_memory(large_outputs) == size * NOTEBOOK_MEMORY_FACTOR
+        assert _estimate_memory(large_outputs, remove_outputs=True) < size * 2
+
+        cell["outputs"] = []
+        small_cells = Path(tmp_dir, "small_cells.ipynb")
+        small_cells.write_text(json.dumps({"cells": [cell] * 1000}))
+        size = small_cells.stat().st_size
+        assert _estimate_memory(small_cells, remove_outputs=True) == (
+            size * NOTEBOOK_MEMORY_FACTOR
+        )
+
+        assert _estimate_memory(Path(tmp_dir, "missing.ipynb"), True) == 0
+
+
+def test_unchanged_not_rewritten(capsys: pytest.CaptureFixture) -> None:
+    """Lab files whose cleaned contents are the same bytes aren't rewritten"""
+    data = {
+        "cells": [
+            {
+                "cell_type": "code",
+                "execution_count": "null",
+                "metadata": {"tags": ["keep"]},
+                "outputs": [],
+                "source": ["a = 1\n", "a"],
+            },
+        ],
+        "metadata": {"language_info": {"version": "3.10.10"}},
+        "nbformat": 4,
+        "nbformat_minor": 2,
+    }
+
+    file = tempfile.NamedTemporaryFile(suffix=".ipynb", delete=False)
+    with open(file.name, "w") as f:
+        json.dump(data, f, indent=4)
+        f.write("\n")
+    os.utime(file.name, (0, 0))
+    input_args = [
+        "jupyter-cleaner",
+        file.name,
+        "--execution_count",
+        "0",
+        "--remove_outputs",
+        "--format",
+        "--reorder_imports",
+        "--preserve_cell_metadata",
+        "tags",
+        "--ignore_pyproject",
+    ]
+    with mock.patch.object(sys, "argv", input_args):
+        main()
+    assert capsys.readouterr().out == ""
+    assert os.stat(file.name).st_mtime == 0
+
+    # the same lab file with another indent level is rewritten
+    with open(file.name, "w") as f:
+        json.dump(data, f, indent=1)
+    with mock.patch.object(sys, "argv", input_args):
+        main()
+    assert capsys.readouterr().out == f"Reformatted {file.name}\n"
+    with open(file.name) as f:
+        assert f.read() == json.dumps(data, indent=4) + "\n"
+
+
+def test_fast() -> None:
+    """With --fast, black's safety checks are only run on a sample of cells"""
+    data = {
+        "cells": [
+            {
+                "cell_type": "code",
+                "execution_count": 5,
+                "metadata": {},
+                "outputs": [],
+                "source": [source],
+            }
+            for source in (
+                "fast_0=1",
+                "fast_1=1",
+                "fast_2=1",
+                "fast_3   =   1       ",
+                "fast_4=1",
+            )
+        ],
+        "metadata": {"language_info": {"version": "3.10.10"}},
+        "nbformat": 4,
+        "nbformat_minor": 2,
+    }
+
+    file = tempfile.NamedTemporaryFile(suffix=".ipynb", delete=False)
+    with open(file.name, "w") as f:
+        json.dump(data, f)
+    input_args = [
+        "jupyter-cleaner",
+        file.name,
+        "--format",
+        "--fast",
+        "--verify_every",
+        "4",
+        "--verify_length_change",
+        "0.3",
+        "--ignore_pyproject",
+    ]
+    _get_cell_cache.cache_clear()
+    with mock.patch.object(sys, "argv", input_args), mock.patch(
+        "black.format_cell", wraps=black.format_cell
+    ) as format_cell:
+        main()
+    assert [call.kwargs["fast"] for call in format_cell.call_args_list] == [
+        False,
+        True,
+        True,
+        True,
+        False,
+        False,
+    ]
+    with open(file.name) as f:
+        formatted_data = json.load(f)
+    assert [cell["source"] for cell in formatted_data["cells"]] == [
+        ["fast_0 = 1"],
+        ["fast_1 = 1"],
+        ["fast_2 = 1"],
+        ["fast_3 = 1"],
+        ["fast_4 = 1"],
+    ]
+
+
+def test_changed_in_git(
+    capsys: pytest.CaptureFixture, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    """Only lab files that changed in git are formatted"""
+    data = {
+        "cells": [
+            {
+                "cell_type": "code",
+                "execution_count": 5,
+                "metadata": {},
+                "outputs": [],
+                "source": ["a=1"],
+            },
+        ],
+        "metadata": {"language_info": {"version": "3.10.10"}},
+        "nbformat": 4,
+        "nbformat_minor": 2,
+    }
+
+    def git(*args: str) -> None:
+        subprocess.run(
+            ["git", "-c", "user.name=test", "-c", "user.email=test@test", *args],
+            check=True,
+            capture_output=True,
+        )
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        monkeypatch.chdir(tmp_dir)
+        Path("sub").mkdir()
+        for name in ("modified.ipynb", "committed.ipynb", "sub/other.ipynb"):
+            Path(name).write_text(json.dumps(data))
+        git("init", "-q")
+        git("add", ".")
+        git("commit", "-q", "-m", "init")
+        Path("modified.ipynb").write_text(json.dumps(data, indent=1))
+        Path("staged.ipynb").write_text(json.dumps(data))
+        git("add", "staged.ipynb")
+        Path("untracked.ipynb").write_text(json.dumps(data))
+        root = Path(tmp_dir).resolve()
+
+        input_args = ["jupyter-cleaner", ".", "--format", "--ignore_pyproject"]
+        with mock.patch.object(sys, "argv", input_args + ["--staged"]):
+            main()
+        assert capsys.readouterr().out.splitlines() == [
+            f"Reformatted {root / 'staged.ipynb'}",
+        ]
+
+        with mock.patch.object(
+            sys,
+            "argv",
+            input_args
+            + ["--changed_since", "HEAD", "--exclude_files_or_dirs", "staged.ipynb"],
+        ):
+            main()
+        assert capsys.readouterr().out.splitlines() == [
+            f"Reformatted {root / 'modified.ipynb'}",
+        ]
+
+        input_args = ["jupyter-cleaner", "sub", "--ignore_pyproject"]
+        with mock.patch.object(sys, "argv", input_args + ["--changed_since", "HEAD"]):
+            main()
+        assert capsys.readouterr().out == ""
+
+        with mock.patch.object(
+            sys, "argv", input_args + ["--changed_since", "missing"]
+        ), pytest.raises(ValueError):
+            main()
+
+        # lab files outside of the current directory
+        for name in ("modified.ipynb", "sub/other.ipynb"):
+            Path(name).write_text(json.dumps(data, indent=1))
+        monkeypatch.chdir("sub")
+        input_args = ["jupyter-cleaner", "..", "--ignore_pyproject"]
+        with mock.patch.object(sys, "argv", input_args + ["--changed_since", "HEAD"]):
+            main()
+        assert capsys.readouterr().out.splitlines() == [
+            f"Reformatted {root / 'modified.ipynb'}",
+            f"Reformatted {root / 'sub' / 'other.ipynb'}",
+        ]
+
+        # names are still relative to the root with diff.relative set
+        git("config", "diff.relative", "true")
+        for name in ("../modified.ipynb", "other.ipynb"):
+            Path(name).write_text(json.dumps(data, indent=1))
+        with mock.patch.object(sys, "argv", input_args + ["--changed_since", "HEAD"]):
+            main()
+        assert capsys.readouterr().out.splitlines() == [
+            f"Reformatted {root / 'modified.ipynb'}",
+            f"Reformatted {root / 'sub' / 'other.ipynb'}",
+        ]
+
+
+def test_lazy_imports() -> None:
+    """black and reorder-python-imports aren't imported until a cell is formatted"""
+    code = "import sys, jupyter_cleaner.jupyter_cleaner; print(sorted(sys.modules))"
+    modules = subprocess.run(
+        [sys.executable, "-c", code],
+        capture_output=True,
+        check=True,
+        text=True,
+        env={**os.environ, "PYTHONPATH": str(Path(__file__).parents[1])},
+    ).stdout
+    assert "'black'" not in modules
+    assert "'reorder_python_imports'" not in modules
+
+
+@pytest.mark.parametrize(
+    "fsync,fsync_calls", [("none", 0), ("always", 4), ("batch", 3)]
+)
+def test_fsync(fsync: str, fsync_calls: int) -> None:
+    """Lab files are replaced atomically, keeping their permissions, and flushed to disk"""
+    data = {
+        "cells": [
+            {
+                "cell_type": "code",
+                "execution_count": 5,
+                "metadata": {},
+                "outputs": [],
+                "source": ["a=1"],
+            },
+        ],
+        "metadata": {"language_info": {"version": "3.10.10"}},
+        "nbformat": 4,
+        "nbformat_minor": 2,
+    }
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        files = [Path(tmp_dir, f"{i}.ipynb") for i in range(2)]
+        for file in files:
+            file.write_text(json.dumps(data))
+            file.chmod(0o640)
+        link = Path(tmp_dir, "link.ipynb")
+        link.symlink_to(files[1])
+        input_args = [
+            "jupyter-cleaner",
+            str(files[0]),
+            str(link),
+            "--format",
+            "--fsync",
+            fsync,
+            "--ignore_pyproject",
+        ]
+        # nothing is written with --check, so nothing is flushed
+        with mock.patch.object(sys, "argv", input_args + ["--check"]), mock.patch(
+            "os.fsync"
+        ) as os_fsync, pytest.raises(SystemExit):
+            main()
+        assert os_fsync.call_count == 0
+
+        with mock.patch.object(sys, "argv", input_args), mock.patch(
+            "os.fsync"
+        ) as os_fsync:
+            main()
+
+        assert os_fsync.call_count == fsync_calls
+        assert sorted(os.listdir(tmp_dir)) == ["0.ipynb", "1.ipynb", "link.ipynb"]
+        assert link.is_symlink()
+        for file in files:
+            assert file.stat().st_mode & 0o777 == 0o640
+            with open(file) as f:
+                assert json.load(f)["cells"][0]["source"] == ["a = 1"]
+
+
+def test_interrupted_write() -> None:
+    """An interrupted write or a read-only file leaves the original file"""
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        file = Path(tmp_dir, "notebook.ipynb")
+        file.write_text("{}")
+        with mock.patch("os.replace", side_effect=KeyboardInterrupt), pytest.raises(
+            KeyboardInterrupt
+        ):
+            _write_file(file, "{}\n", "none")
+        assert os.listdir(tmp_dir) == ["notebook.ipynb"]
+        assert file.read_text() == "{}"
+
+        # read-only files aren't replaced. os.access() is mocked, as root can write to them
+        file.chmod(0o444)
+        with mock.patch("os.access", return_value=False), pytest.raises(
+            PermissionError
+        ):
+            _write_file(file, "{}\n", "none")
+        assert os.listdir(tmp_dir) == ["notebook.ipynb"]
+        assert file.read_text() == "{}"
+        assert file.stat().st_mode & 0o777 == 0o444
+
+    with pytest.raises(ValueError):
+        run([], fsync="never")
+
+
+def test_clean_notebook() -> None:
+    """Lab files can be cleaned in memory, from a parsed lab file or its contents"""
+    outputs = [{"output_type": "stream", "text": ["1"]}]
+    data = {
+        "cells": [
+            {
+                "cell_type": "code",
+                "execution_count": 5,
+                "metadata": {"collapsed": True},
+                "outputs": outputs,
+                "source": ["import re\n", "import datetime\n", "a=1"],
+            },
+            {"cell_type": "code", "metadata": {}, "outputs": [], "source": []},
+        ],
+        "metadata": {"language_info": {"version": "3.10.10"}},
+        "nbformat": 4,
+        "nbformat_minor": 2,
+    }
+    expected = {
+        "cells": [
+            {
+                "cell_type": "code",
+                "execution_count": "null",
+                "metadata": {},
+                "outputs": [],
+                "source": ["import datetime\n", "import re\n", "\n", "a = 1"],
+            },
+        ],
+        "metadata": {"language_info": {"version": "3.10.10"}},
+        "nbformat": 4,
+        "nbformat_minor": 2,
+    }
+
+    for notebook in (json.dumps(data), json.dumps(data).encode()):
+        result = clean_notebook(notebook)
+        assert result.changed
+        assert result.notebook == expected
+        assert result.contents == json.dumps(expected, indent=4) + "\n"
+
+    notebook = json.loads(json.dumps(data))
+    result = clean_notebook(notebook, Options(indent_level=1))
+    assert result.notebook is notebook
+    assert result.notebook == expected
+    assert result.contents == json.dumps(expected, indent=1) + "\n"
+    assert not clean_notebook(notebook).changed
+    # contents are changed when they serialise to different bytes
+    assert not clean_notebook(json.dumps(expected, indent=4) + "\n").changed
+    assert clean_notebook(json.dumps(expected, indent=1) + "\n").changed
+    with mock.patch("os.linesep", "\r\n"):
+        assert not clean_notebook(json.dumps(expected, indent=4) + "\n").changed
+
+    result = clean_notebook(json.dumps(data), Options(remove_outputs=False))
+    assert result.notebook["cells"][0]["outputs"] == outputs
+
+
+def test_check(capsys: pytest.CaptureFixture) -> None:
+    """With --check, lab files aren't written and the first modified cell stops cleaning"""
+    clean = {
+        "cells": [
+            {
+                "cell_type": "code",
+                "execution_count": "null",
+                "metadata": {},
+                "outputs": [],
+                "source": ["a = 1"],
+            }
+        ]
+        * 3,
+        "metadata": {"language_info": {"version": "3.10.10"}},
+        "nbformat": 4,
+        "nbformat_minor": 2,
+    }
+    dirty = json.loads(json.dumps(clean))
+    dirty["cells"][0]["source"] = ["a=1"]
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        clean_file = Path(tmp_dir, "clean.ipynb")
+        clean_file.write_text(json.dumps(clean, indent=4) + "\n")
+        dirty_file = Path(tmp_dir, "dirty.ipynb")
+        dirty_file.write_text(json.dumps(dirty, indent=4) + "\n")
+        input_args = ["jupyter-cleaner", "--ignore_pyproject", "--format", "--check"]
+
+        with mock.patch.object(sys, "argv", input_args + [str(clean_file)]):
+            main()
+        assert capsys.readouterr().out == ""
+
+        with mock.patch.object(sys, "argv", input_args + [tmp_dir]), mock.patch(
+            "jupyter_cleaner.jupyter_cleaner._format_cell", wraps=_format_cell
+        ) as format_cell, pytest.raises(SystemExit) as e:
+            main()
+        assert e.value.code == 1
+        assert capsys.readouterr().out == f"Would reformat {dirty_file}\n"
+        # all cells of the clean lab file, and the first cell of the dirty lab file
+        assert format_cell.call_count == 4
+        assert json.loads(dirty_file.read_text()) == dirty
+        assert run([clean_file, dirty_file], check=True) == [dirty_file]
+
+
+def test_register_transform() -> None:
+    """Registered transforms run on every cell in the same pass as the built-in transforms"""
+    data = {
+        "cells": [
+            {
+                "cell_type": "code",
+                "execution_count": 5,
+                "metadata": {},
+                "outputs": [],
+                "source": ["a=1"],
+            },
+            {"cell_type": "markdown", "metadata": {}, "source": ["# Title"]},
+        ],
+        "metadata": {"language_info": {"version": "3.10.10"}},
+        "nbformat": 4,
+        "nbformat_minor": 2,
+    }
+    sources = []
+
+    def upper(context: CellContext) -> bool:
+        sources.append(context.source)
+        if context.is_code:
+            return False
+        return context.set_source(context.source.upper())
+
+    transforms = list(_TRANSFORMS)
+    try:
+        register_transform("upper", before="format")(upper)
+        with pytest.raises(ValueError):
+            register_transform("upper")(upper)
+        with pytest.raises(ValueError):
+            register_transform("lower", before="unknown")(upper)
+
+        timings: Dict[str, float] = {}
+        # transforms that are switched off aren't run or timed
+        result = clean_notebook(
+            json.dumps(data), Options(remove_outputs=False), timings=timings
+        )
+    finally:
+        _TRANSFORMS[:] = transforms
+
+    assert result.changed
+    assert sources == ["a=1", "# Title"]  # before the cell is formatted
+    assert [cell["source"] for cell in result.notebook["cells"]] == [
+        ["a = 1"],
+        ["# TITLE"],
+    ]
+    assert list(timings) == [
+        "remove_empty_cells",
+        "execution_count",
+        "upper",
+        "format",
+        "reorder_imports",
+        "clear_cell_metadata",
+    ]
+
+
+def test_cell_source() -> None:
+    """The source of a cell is kept as a string between transforms and split into lines once"""
+    cell = {"cell_type": "code", "metadata": {}, "source": ["import re\n", "a=1"]}
+    notebook = NotebookContext(Options(), _get_cell_cache(None, 0, os.getpid()), (3,))
+    context = CellContext(cell, notebook)
+    assert context.source == "import re\na=1"
+    assert context.set_source("import re\na = 1")
+    assert not context.set_source("import re\na = 1")
+    assert cell["source"] == ["import re\n", "a=1"]
+    assert context.write_source()
+    assert cell["source"] == ["import re\n", "a = 1"]
+
+    # lines are normalised even if the source is unchanged
+    cell = {"cell_type": "code", "metadata": {}, "source": ["a = 1\na"]}
+    context = CellContext(cell, notebook)
+    assert not context.write_source()
+    assert not context.set_source(context.source)
+    assert context.write_source()
+    assert cell["source"] == ["a = 1\n", "a"]
+
+
+def test_remove_many_empty_cells() -> None:
+    """Consecutive empty cells are all removed from lab files with many cells"""
+    notebook = {
+        "cells": [
+            {
+                "cell_type": "code",
+                "execution_count": None,
+                "metadata": {},
+                "outputs": [],
+                "source": [] if i % 4 < 2 else [f"a_{i} = {i}"],
+            }
+            for i in range(10_000)
+        ],
+        "metadata": {"language_info": {"version": "3.10.10"}},
+        "nbformat": 4,
+        "nbformat_minor": 2,
+    }
+    result = clean_notebook(notebook, Options(format=False, reorder_imports=False))
+    assert result.changed
+    assert [cell["source"] for cell in result.notebook["cells"]] == [
+        [f"a_{i} = {i}"] for i in range(10_000) if i % 4 >= 2
+    ]
+
+
+def test_get_lab_files() -> None:
+    """Excluded and pruned directories aren't searched for lab files"""
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        root = Path(tmp_dir)
+        for name in (
+            "a.ipynb",
+            "a.py",
+            "sub/b.ipynb",
+            "sub/deep/c.ipynb",
+            "excluded/d.ipynb",
+            "sub/excluded.ipynb",
+            ".git/e.ipynb",
+            "sub/.ipynb_checkpoints/b-checkpoint.ipynb",
+            "node_modules/f.ipynb",
+            "build/g.ipynb",
+        ):
+            Path(root, name).parent.mkdir(parents=True, exist_ok=True)
+            Path(root, name).write_text("{}")
+        Path(root, "link").symlink_to(Path(root, "sub"))
+
+        exclude = [Path(root, "excluded"), Path(root, "sub", "excluded.ipynb")]
+        expected = [
+            Path(root, name) for name in ("a.ipynb", "sub/b.ipynb", "sub/deep/c.ipynb")
+        ]
+        assert get_lab_files([root], exclude) == expected
+        assert get_lab_files([root], exclude, prune_dirs=[".git", "deep"]) == sorted(
+            expected[:2]
+            + [
+                Path(root, name)
+                for name in (
+                    "build/g.ipynb",
+                    "node_modules/f.ipynb",
+                    "sub/.ipynb_checkpoints/b-checkpoint.ipynb",
+                )
+            ]
+        )
+        # directories are only pruned while searching
+        assert get_lab_files([Path(root, "build")]) == [Path(root, "build/g.ipynb")]
+        assert get_lab_files([Path(root, "excluded")], exclude) == []
+        # lab files passed explicitly are excluded by their parent directories
+        assert get_lab_files([Path(root, "excluded", "d.ipynb")], exclude) == []
+        with pytest.raises(ValueError):
+            get_lab_files([Path(root, "missing")])
+
+        with mock.patch.object(
+            sys,
+            "argv",
+            ["jupyter-cleaner", tmp_dir, "--ignore_pyproject", "--prune_dirs", "sub"],
+        ), mock.patch("jupyter_cleaner.jupyter_cleaner.run") as run_mock:
+            main()
+        pruned = [
+            Path(root, name)
+            for name in (
+                ".git/e.ipynb",
+                "a.ipynb",
+                "build/g.ipynb",
+                "excluded/d.ipynb",
+                "node_modules/f.ipynb",
+            )
+        ]
+        assert run_mock.call_args.args[0] == pruned
+
+        # a single directory in pyproject.toml
+        with mock.patch.object(sys, "argv", ["jupyter-cleaner", tmp_dir]), mock.patch(
+            "jupyter_cleaner.jupyter_cleaner.tomllib.load",
+            return_value={"tool": {"jupyter-cleaner": {"prune_dirs": "sub"}}},
+        ), mock.patch("jupyter_cleaner.jupyter_cleaner.run") as run_mock:
+            main()
+        assert run_mock.call_args.args[0] == pruned
+
+
+def test_gitignore() -> None:
+    """Lab files and directories ignored by .gitignore files aren't searched"""
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        root = Path(tmp_dir)
+        Path(root, ".git").mkdir()
+        Path(root, ".gitignore").write_text("output/\n*.out.ipynb\n!keep.out.ipynb\n")
+        for name in (
+            "a.ipynb",
+            "a.out.ipynb",
+            "keep.out.ipynb",
+            "output/b.ipynb",
+            "sub/c.ipynb",
+            "sub/local.ipynb",
+            "sub/d.out.ipynb",
+            "sub/deep/local.ipynb",
+            "sub/deep/output/e.ipynb",
+        ):
+            Path(root, name).parent.mkdir(parents=True, exist_ok=True)
+            Path(root, name).write_text("{}")
+        Path(root, "sub", ".gitignore").write_text("local.ipynb\n")
+
+        assert get_lab_files([root]) == [
+            Path(root, name) for name in ("a.ipynb", "keep.out.ipynb", "sub/c.ipynb")
+        ]
+        # .gitignore files of parent directories up to the project root apply
+        assert get_lab_files([Path(root, "sub", "deep")]) == []
+        # lab files passed explicitly are never ignored
+        assert get_lab_files([Path(root, "a.out.ipynb")]) == [Path(root, "a.out.ipynb")]
+        assert len(get_lab_files([root], gitignore=False)) == 9
+
+        Path(root, "sub", ".gitignore").write_text("!\n")
+        with pytest.raises(ValueError, match="Could not parse"):
+            get_lab_files([root])
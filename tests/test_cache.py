@@ -0,0 +1,159 @@
+import json
+import os
+import sys
+import tempfile
+from pathlib import Path
+from unittest import mock
+
+from jupyter_cleaner.cache import Cache
+from jupyter_cleaner.cache import CACHE_DIR_ENV
+from jupyter_cleaner.cache import CellCache
+from jupyter_cleaner.cache import get_cache_dir
+from jupyter_cleaner.jupyter_cleaner import _get_cell_cache
+from jupyter_cleaner.jupyter_cleaner import main
+
+
+def test_cache() -> None:
+    """Lab files that are unchanged since they were last formatted are skipped"""
+    data = {
+        "cells": [
+            {
+                "cell_type": "code",
+                "execution_count": 5,
+                "metadata": {},
+                "outputs": [],
+                "source": ["a=1\na"],
+            },
+        ],
+        "metadata": {"language_info": {"version": "3.10.10"}},
+        "nbformat": 4,
+        "nbformat_minor": 2,
+    }
+
+    with tempfile.TemporaryDirectory() as tmp_dir, mock.patch.dict(
+        os.environ, {CACHE_DIR_ENV: tmp_dir}
+    ):
+        file = Path(tmp_dir, "notebook.ipynb")
+        with open(file, "w") as f:
+            json.dump(data, f)
+        input_args = ["jupyter-cleaner", str(file), "--ignore_pyproject", "--cache"]
+
+        with mock.patch.object(sys, "argv", input_args + ["--format"]):
+            main()
+        assert len(list(Path(tmp_dir).glob("cache.*.json"))) == 1
+
+        with mock.patch.object(sys, "argv", input_args + ["--format"]), mock.patch(
+            "jupyter_cleaner.jupyter_cleaner._clean_file"
+        ) as clean_file:
+            main()
+        clean_file.assert_not_called()
+
+        # different options use a different cache
+        with mock.patch.object(sys, "argv", input_args), mock.patch(
+            "jupyter_cleaner.jupyter_cleaner._clean_file"
+        ) as clean_file:
+            main()
+        clean_file.assert_called_once()
+
+        with open(file, "w") as f:
+            json.dump(data, f)
+        with mock.patch.object(sys, "argv", input_args + ["--format"]), mock.patch(
+            "jupyter_cleaner.jupyter_cleaner._clean_file"
+        ) as clean_file:
+            main()
+        clean_file.assert_called_once()
+
+
+def test_cache_is_changed() -> None:
+    """Modification time is checked before the contents of a file"""
+    with tempfile.TemporaryDirectory() as tmp_dir, mock.patch.dict(
+        os.environ, {CACHE_DIR_ENV: tmp_dir}
+    ):
+        assert get_cache_dir() == Path(tmp_dir)
+        file = Path(tmp_dir, "notebook.ipynb")
+        file.write_text("{}")
+
+        cache = Cache.read({})
+        assert cache.is_changed(file)
+        cache.write([file])
+        cache = Cache.read({})
+        assert not cache.is_changed(file)
+
+        # same contents, new modification time
+        os.utime(file, (0, 0))
+        assert not cache.is_changed(file)
+        file.write_text("[]")
+        assert cache.is_changed(file)
+        file.write_text("[1]")
+        assert cache.is_changed(file)
+
+        # corrupt caches are ignored
+        cache.cache_file.write_text("{")
+        assert Cache.read({}).file_data == {}
+
+    with mock.patch.dict(os.environ, {CACHE_DIR_ENV: "", "XDG_CACHE_HOME": "cache"}):
+        assert get_cache_dir() == Path("cache", "jupyter-cleaner")
+
+
+def test_cell_cache() -> None:
+    """Formatted cells are kept in memory and in a size bounded persistent store"""
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        store = Path(tmp_dir, "cells.sqlite")
+        cell_cache = CellCache(maxsize=2, store=store, max_store_size=10)
+        keys = [CellCache.key(source, "mode") for source in ("a", "b", "c")]
+        assert len(set(keys)) == 3
+        assert CellCache.key("a", "other mode") != keys[0]
+
+        for key, source in zip(keys, ("aaaa", "bbbb", "cccc")):
+            assert cell_cache.get(key) is None
+            cell_cache.put(key, source)
+        assert list(cell_cache.entries) == keys[1:]
+        assert cell_cache.get(keys[0]) == "aaaa"  # from the persistent store
+        assert list(cell_cache.entries) == [keys[2], keys[0]]
+
+        # "b" is the least recently used entry in the store
+        cell_cache.evict()
+        cell_cache = CellCache(store=store)
+        assert cell_cache.get(keys[0]) == "aaaa"
+        assert cell_cache.get(keys[1]) is None
+        assert cell_cache.get(keys[2]) == "cccc"
+        cell_cache.evict()
+        assert CellCache().get(keys[0]) is None
+
+
+def test_cell_cache_between_runs() -> None:
+    """Cells formatted in a previous run aren't formatted by black again"""
+    data = {
+        "cells": [
+            {
+                "cell_type": "code",
+                "execution_count": 5,
+                "metadata": {},
+                "outputs": [],
+                "source": ["a=1\na"],
+            },
+        ],
+        "metadata": {"language_info": {"version": "3.10.10"}},
+        "nbformat": 4,
+        "nbformat_minor": 2,
+    }
+
+    with tempfile.TemporaryDirectory() as tmp_dir, mock.patch.dict(
+        os.environ, {CACHE_DIR_ENV: tmp_dir}
+    ):
+        files = [Path(tmp_dir, f"{i}.ipynb") for i in range(2)]
+        for file in files:
+            with open(file, "w") as f:
+                json.dump(data, f)
+        input_args = ["jupyter-cleaner", "--ignore_pyproject", "--cache", "--format"]
+
+        with mock.patch.object(sys, "argv", input_args + [str(files[0])]):
+            main()
+        _get_cell_cache.cache_clear()
+        with mock.patch.object(sys, "argv", input_args + [str(files[1])]), mock.patch(
+            "black.format_cell"
+        ) as format_cell:
+            main()
+        format_cell.assert_not_called()
+        with open(files[1]) as f:
+            assert json.load(f)["cells"][0]["source"] == ["a = 1\n", "a"]
@@ -0,0 +1,119 @@
+import json
+import tempfile
+import threading
+from pathlib import Path
+from typing import Iterator
+from unittest import mock
+
+import pytest
+from jupyter_cleaner import daemon
+from jupyter_cleaner.daemon import clean_file
+from jupyter_cleaner.daemon import make_server
+
+DATA = {
+    "cells": [
+        {
+            "cell_type": "code",
+            "execution_count": 5,
+            "metadata": {},
+            "outputs": [],
+            "source": ["a=1\na"],
+        },
+    ],
+    "metadata": {"language_info": {"version": "3.10.10"}},
+    "nbformat": 4,
+    "nbformat_minor": 2,
+}
+
+
+@pytest.fixture(scope="module")
+def port() -> Iterator[int]:
+    server = make_server(port=0)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server.server_address[1]
+    server.shutdown()
+    server.server_close()
+
+
+def test_daemon(port: int) -> None:
+    """Lab files are cleaned by the daemon and only rewritten when changed"""
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        file = Path(tmp_dir, "notebook.ipynb")
+        file.write_text(json.dumps(DATA))
+
+        assert clean_file(file, {"execution_count": 1}, port=port)
+        cell = json.loads(file.read_text())["cells"][0]
+        assert cell["source"] == ["a = 1\n", "a"]
+        assert cell["execution_count"] == 1
+        assert not clean_file(file, {"execution_count": 1}, port=port)
+        assert (
+            file.read_text()
+            == json.dumps(json.loads(file.read_text()), indent=4) + "\n"
+        )
+
+        with pytest.raises(ValueError, match="Invalid options"):
+            clean_file(file, {"not_an_option": 1}, port=port)
+        file.write_text("{")
+        with pytest.raises(ValueError, match="Invalid lab file"):
+            clean_file(file, {}, port=port)
+        file.write_text("{}")
+        with pytest.raises(ValueError, match="KeyError"):
+            clean_file(file, {}, port=port)
+
+
+def test_client(port: int, capsys: pytest.CaptureFixture) -> None:
+    """The client cleans lab files with the daemon, using the options of jupyter-cleaner"""
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        file = Path(tmp_dir, "notebook.ipynb")
+        excluded = Path(tmp_dir, "excluded", "notebook.ipynb")
+        excluded.parent.mkdir()
+        data = json.loads(json.dumps(DATA))
+        data["cells"][0]["outputs"] = [{"output_type": "stream", "text": ["1"]}]
+        for lab_file in [file, excluded]:
+            lab_file.write_text(json.dumps(data))
+        argv = [
+            tmp_dir,
+            "--bind_port",
+            str(port),
+            "--ignore_pyproject",
+            "--exclude_files_or_dirs",
+            str(excluded.parent),
+        ]
+
+        # only the indent level is changed by default
+        daemon.client(argv)
+        cell = json.loads(file.read_text())["cells"][0]
+        assert cell["source"] == ["a=1\na"]
+        assert cell["outputs"] == data["cells"][0]["outputs"]
+        assert cell["execution_count"] == 5
+        assert capsys.readouterr().out == f"Reformatted {file}\n"
+
+        with pytest.raises(SystemExit):
+            daemon.client(argv + ["--format", "--check"])
+        assert json.loads(file.read_text())["cells"][0]["source"] == ["a=1\na"]
+        assert capsys.readouterr().out == f"Would reformat {file}\n"
+
+        daemon.client(argv + ["--format", "--remove_outputs"])
+        cell = json.loads(file.read_text())["cells"][0]
+        assert cell["source"] == ["a = 1\n", "a"]
+        assert cell["outputs"] == []
+        assert json.loads(excluded.read_text()) == data
+        assert capsys.readouterr().out == f"Reformatted {file}\n"
+
+        file.write_text("{")
+        daemon.client(argv + ["--ignore_fails"])
+        assert capsys.readouterr().out == f"Reformatting failed: {file}\n"
+        with pytest.raises(ValueError):
+            daemon.client(argv)
+        assert capsys.readouterr().out.endswith(f"Reformatting failed: {file}\n")
+
+
+def test_serve() -> None:
+    """The daemon serves until it's interrupted"""
+    with mock.patch(
+        "http.server.ThreadingHTTPServer.serve_forever",
+        side_effect=KeyboardInterrupt,
+    ) as serve_forever:
+        daemon.daemon(["--bind_port", "0"])
+    serve_forever.assert_called_once()
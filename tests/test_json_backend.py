@@ -0,0 +1,82 @@
+import importlib.util
+import json
+import sys
+from typing import Any
+
+import pytest
+from jupyter_cleaner import json_backend
+from jupyter_cleaner import reader
+from tests.test_reader import lab_file
+from tests.test_reader import OUTPUTS
+
+requires_orjson = pytest.mark.skipif(
+    importlib.util.find_spec("orjson") is None, reason="orjson isn't installed"
+)
+
+# without floats, which are always serialised with json
+LAB_FILE = {
+    "cells": [
+        {
+            "cell_type": "code",
+            "execution_count": 1,
+            "metadata": {"tags": ["a", {"b": [[], {}, [[], {"c": {}}]]}]},
+            "outputs": [{"data": {"image/png": "iVBORw0KGgo" * 1000}}],
+            "source": ["print('é')\n", "a = [1, {2: 3}]"],
+        }
+    ],
+    "strings": [
+        'é ☃ \U0001f600 \x7f \x00\x1f\n\t"\\/',
+        "  indented\n  lines  ",
+        "",
+    ],
+    "scalars": [0, -1, 2**63 - 1, True, False, None],
+}
+
+
+@requires_orjson
+@pytest.mark.parametrize("indent", [-1, 0, 1, 2, 4])
+@pytest.mark.parametrize(
+    "data",
+    [
+        LAB_FILE,
+        {"ascii": ["a", {"b": 1}]},
+        {"floats": [1.5, 1e16, 1e-5, float("nan"), float("inf")]},
+        {"big": 2**64},
+        {"surrogate": "\ud800"},
+        {"tuple": (1, 2)},
+    ],
+)
+def test_dumps(indent: int, data: Any) -> None:
+    """orjson writes the same lab files as json"""
+    assert json_backend.dumps(data, indent, "orjson") == json.dumps(data, indent=indent)
+
+
+@requires_orjson
+def test_loads() -> None:
+    """orjson parses the same lab files as json"""
+    contents = json.dumps(lab_file(OUTPUTS), indent=1).encode()
+    assert json_backend.loads(contents, "orjson") == lab_file(OUTPUTS)
+    for backend in ["json", "orjson"]:
+        assert reader.loads(contents, True, backend) == (lab_file([]), True)
+
+    # only parsed by json
+    assert json_backend.loads(b"[NaN, 18446744073709551616]", "orjson")[1] == 2**64
+    with pytest.raises(json.JSONDecodeError):
+        json_backend.loads(b'{"a": }', "orjson")
+
+
+def test_get_backend(monkeypatch: pytest.MonkeyPatch) -> None:
+    """auto falls back to json when orjson isn't installed"""
+    json_backend.get_backend.cache_clear()
+    monkeypatch.setitem(sys.modules, "orjson", None)
+    try:
+        assert json_backend.get_backend("auto") == "json"
+        assert json_backend.get_backend("json") == "json"
+        with pytest.raises(ValueError, match="requires orjson"):
+            json_backend.get_backend("orjson")
+        with pytest.raises(ValueError, match="must be one of"):
+            json_backend.get_backend("ujson")
+        assert json_backend.dumps({"a": [1]}, 1) == json.dumps({"a": [1]}, indent=1)
+        assert json_backend.loads(b'{"a": [1]}') == {"a": [1]}
+    finally:
+        json_backend.get_backend.cache_clear()
@@ -0,0 +1,129 @@
+import json
+import sys
+import tempfile
+from pathlib import Path
+from unittest import mock
+
+import pytest
+from jupyter_cleaner.jupyter_cleaner import _get_cell_cache
+from jupyter_cleaner.jupyter_cleaner import main
+from jupyter_cleaner.profiling import Profile
+
+DATA = {
+    "cells": [
+        {
+            "cell_type": "code",
+            "execution_count": 5,
+            "metadata": {},
+            "outputs": [],
+            "source": ["import re\n", "a=1"],
+        },
+        {"cell_type": "markdown", "metadata": {}, "source": ["# Title"]},
+    ],
+    "metadata": {"language_info": {"version": "3.10.10"}},
+    "nbformat": 4,
+    "nbformat_minor": 2,
+}
+
+
+@pytest.mark.parametrize("jobs, prefetch", [(1, 0), (2, 0), (1, 2)])
+def test_profile(jobs: int, prefetch: int, capsys: pytest.CaptureFixture) -> None:
+    """--profile reports the time taken by each phase, lab file and cell"""
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        files = [Path(tmp_dir, f"{i}.ipynb") for i in range(2)]
+        for file in files:
+            file.write_text(json.dumps(DATA))
+        report = Path(tmp_dir, "profile.json")
+        input_args = [
+            "jupyter-cleaner",
+            *map(str, files),
+            "--ignore_pyproject",
+            "--format",
+            "--reorder_imports",
+            "--jobs",
+            str(jobs),
+            "--prefetch",
+            str(prefetch),
+            "--profile",
+            "--profile_output",
+            str(report),
+        ]
+        with mock.patch.object(sys, "argv", input_args):
+            main()
+
+        out = capsys.readouterr().out
+        assert "Slowest lab files" in out
+        assert f"{files[0]} (cell 1)" in out
+        profile = json.loads(report.read_text())
+        assert list(profile["phases"]) == [
+            "read",
+            "parse",
+            "format",
+            "reorder_imports",
+            "serialize",
+            "write",
+        ]
+        # transforms are called for every cell
+        assert [phase["calls"] for phase in profile["phases"].values()] == [
+            2,
+            2,
+            4,
+            4,
+            2,
+            2,
+        ]
+        assert sorted(notebook["file"] for notebook in profile["notebooks"]) == [
+            str(file) for file in files
+        ]
+        assert all(notebook["cells"] == 2 for notebook in profile["notebooks"])
+        assert len(profile["cells"]) == 4
+        assert {k: v["lookups"] for k, v in profile["dedup"].items()} == {
+            "format": 2,
+            "reorder_imports": 2,
+        }
+
+
+def test_profile_summary() -> None:
+    """Only the slowest lab files and cells are listed"""
+    profile = Profile()
+    for i in range(3):
+        other = Profile()
+        with other.notebook(Path(f"{i}.ipynb")), other.phase("read"):
+            other.add_cell(0, i)
+        other.notebooks = [(file, i, i, cells) for file, _, _, cells in other.notebooks]
+        profile.merge(other)
+    assert profile.phases["read"][2] == 3
+    assert [cells for _, _, _, cells in profile.notebooks] == [1, 1, 1]
+
+    lines = profile.summary(top=2).splitlines()
+    assert [line.split()[0] for line in lines[3:6]] == [
+        "Slowest",
+        "2.ipynb",
+        "1.ipynb",
+    ]
+    assert lines[-2].startswith("2.ipynb (cell 0)")
+    assert lines[-1].startswith("1.ipynb (cell 0)")
+
+
+def test_verbose(capsys: pytest.CaptureFixture) -> None:
+    """--verbose reports the cells that were reused from cells with the same source"""
+    _get_cell_cache.cache_clear()
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        files = [Path(tmp_dir, f"{i}.ipynb") for i in range(3)]
+        for file in files:
+            file.write_text(json.dumps(DATA))
+        input_args = [
+            "jupyter-cleaner",
+            *map(str, files),
+            "--ignore_pyproject",
+            "--format",
+            "--reorder_imports",
+            "--verbose",
+        ]
+        with mock.patch.object(sys, "argv", input_args):
+            main()
+
+    lines = capsys.readouterr().out.splitlines()
+    assert lines[-3].startswith("Deduplicated cells")
+    assert lines[-2].split() == ["format", "2", "3", "66.7%"]
+    assert lines[-1].split() == ["reorder_imports", "2", "3", "66.7%"]
@@ -0,0 +1,110 @@
+import json
+from typing import Any
+from typing import Dict
+
+import pytest
+from jupyter_cleaner import reader
+
+
+def lab_file(outputs: Any) -> Dict[str, Any]:
+    return {
+        "cells": [
+            {
+                "cell_type": "code",
+                "execution_count": 1,
+                "metadata": {"tags": ["outputs", {"b": [1.5, None, True]}]},
+                "outputs": outputs,
+                "source": ["print('\"é\\')\n", 'a = {"outputs": [1, {2: 3}]}'],
+            },
+            {"cell_type": "markdown", "metadata": {}, "source": ["# [Title] {"]},
+            {"cell_type": "code", "metadata": {}, "outputs": [], "source": []},
+        ],
+        "metadata": {"language_info": {"version": "3.10.10"}},
+        "nbformat": 4,
+        "nbformat_minor": 2,
+    }
+
+
+OUTPUTS = [
+    {
+        "data": {
+            "image/png": "iVBORw0KGgo" * 5000,
+            "text/plain": ['"]}[{\\', "é ☃", '\\\\"', "\u0000"],
+        },
+        "metadata": {"nested": [[[]], {}, {"a": [-1e-5, 0, False]}]},
+        "output_type": "display_data",
+    }
+]
+
+
+@pytest.mark.parametrize("indent", [None, 1, 4])
+@pytest.mark.parametrize("ensure_ascii", [True, False])
+def test_skip_outputs(indent: Any, ensure_ascii: bool) -> None:
+    """Outputs are skipped and the rest of the lab file is parsed as with json"""
+    contents = json.dumps(
+        lab_file(OUTPUTS), indent=indent, ensure_ascii=ensure_ascii
+    ).encode()
+    assert reader.loads(contents, skip_outputs=True) == (lab_file([]), True)
+    assert reader.loads(contents, skip_outputs=False) == (lab_file(OUTPUTS), False)
+
+    contents = json.dumps(lab_file([]), indent=indent).encode()
+    assert reader.loads(contents, skip_outputs=True) == (lab_file([]), False)
+
+
+def test_short_outputs() -> None:
+    """Lab files with short outputs are parsed with json, which is faster"""
+    outputs = [{"output_type": "stream", "text": ["a\n"] * 100}]
+    contents = json.dumps(lab_file(outputs)).encode()
+    assert reader.loads(contents, skip_outputs=True) == (lab_file(outputs), False)
+
+
+@pytest.fixture
+def always_skip_outputs(monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(reader, "MIN_BYTES_PER_QUOTE", 0)
+
+
+@pytest.mark.parametrize(
+    "contents",
+    [
+        '{"cells": [{"outputs": {}}]}',
+        '{"cells": [1]}',
+        '{"cells": [{}]}',
+        '{"cells": {}}',
+        '{"cells": []} []',
+        "[]",
+        '{"cells": [{"outputs": [1]}], "a": [[[}',
+        "",
+        '{"cells": [{"outputs": [1], "metadata": {"outputs": [2]}}]}',
+        '{"cells": [{"outputs": [1]}], "metadata": {"outputs": []}}',
+    ],
+)
+@pytest.mark.usefixtures("always_skip_outputs")
+def test_unsupported(contents: str) -> None:
+    """Lab files that the reader doesn't support are parsed with json"""
+    try:
+        expected = json.loads(contents)
+    except json.JSONDecodeError:
+        with pytest.raises(json.JSONDecodeError):
+            reader.loads(contents.encode(), skip_outputs=True)
+    else:
+        assert reader.loads(contents.encode(), skip_outputs=True) == (expected, False)
+
+
+@pytest.mark.parametrize(
+    "contents",
+    [
+        '{"cells": [{"outputs": [1, 2}]}',
+        '{"cells": [{"outputs": [1, [2]',
+        '{"cells": [{"outputs": ["]}',
+        '{"cells": [{"outputs": [], "source": ["a]}',
+        '{"cells": [{"outputs": []}], "nbformat": tru}',
+        '{"cells": [{"outputs": []}], "nbformat": }',
+        '{"cells": [], 1: 2}',
+        '{"cells": [{"outputs": []}]',
+    ],
+)
+@pytest.mark.usefixtures("always_skip_outputs")
+def test_invalid(contents: str) -> None:
+    """Invalid lab files raise the same error as json"""
+    with pytest.raises(json.JSONDecodeError):
+        reader.loads(contents.encode(), skip_outputs=True)